@@ -0,0 +1,248 @@
+import json
+import os
+import time
+import uuid
+import numpy as np
+from feature_store import CATEGORICAL_FEATURES, NUMERIC_INDEX, CATEGORICAL_INDEX, build_lock, publish_build
+from catalog_changes import watch_catalog, net_changes
+
+ANN_FORMAT_VERSION = 1
+# Catalogs smaller than this are scanned exactly; the scan is already cheap.
+ANN_MIN_ROWS = 200000
+ANN_CANDIDATE_FACTOR = 200
+NUM_PROBES = 8
+MAX_LISTS = 4096
+KMEANS_ITERATIONS = 12
+KMEANS_SAMPLE_ROWS = 100000
+ASSIGN_BLOCK_ROWS = 65536
+# Rerun k-means once the catalog has grown by this fraction since training.
+RETRAIN_GROWTH = 0.5
+
+
+def ann_index_path(db_path):
+    return os.path.splitext(db_path)[0] + '_ann'
+
+
+def nearest_centroids(data, centroids):
+    """Index of the closest centroid (L2) for each row of data, computed in blocks"""
+    centroid_norms = (centroids * centroids).sum(axis=1)
+    nearest = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), ASSIGN_BLOCK_ROWS):
+        block = np.asarray(data[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float64)
+        nearest[start:start + len(block)] = np.argmin(centroid_norms - 2 * block @ centroids.T, axis=1)
+    return nearest
+
+
+def kmeans(data, num_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    """k-means centroids of data, using faiss when it is installed"""
+    try:
+        import faiss
+    except ImportError:
+        faiss = None
+    if faiss is not None:
+        trainer = faiss.Kmeans(data.shape[1], num_lists, niter=iterations, seed=seed)
+        trainer.train(np.ascontiguousarray(data, dtype=np.float32))
+        return trainer.centroids.astype(np.float64)
+
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float64)
+    centroids = data[rng.choice(len(data), num_lists, replace=False)]
+    for _ in range(iterations):
+        assignment = nearest_centroids(data, centroids)
+        counts = np.bincount(assignment, minlength=num_lists)
+        sums = np.column_stack([np.bincount(assignment, weights=data[:, d], minlength=num_lists)
+                                for d in range(data.shape[1])])
+        filled = counts > 0
+        # Empty clusters keep their previous centroid.
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index over the feature store embedding for candidate generation.
+
+    Catalog rows are clustered with k-means and a query only scores the rows
+    of its closest clusters. Centroids are stored in raw feature units and
+    cluster membership by mobile_data id, so the index outlives feature store
+    rebuilds: new rows are assigned to their nearest centroid and k-means is
+    only rerun once the catalog has grown by RETRAIN_GROWTH since training.
+    """
+
+    def __init__(self, path, meta, centroid_numerics, centroid_categories, ids, lists):
+        self.path = path
+        self.meta = meta
+        self.centroid_numerics = centroid_numerics
+        self.centroid_categories = centroid_categories
+        self.ids = ids
+        self.lists = lists
+        self.build_path = None
+
+    @property
+    def num_lists(self):
+        return len(self.centroid_numerics)
+
+    @classmethod
+    def load(cls, index_dir):
+        with open(os.path.join(index_dir, 'CURRENT')) as f:
+            build_dir = os.path.join(index_dir, f.read().strip())
+        with open(os.path.join(build_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['format_version'] != ANN_FORMAT_VERSION:
+            raise ValueError(f"ANN index format {meta['format_version']} is not {ANN_FORMAT_VERSION}")
+        arrays = [np.load(os.path.join(build_dir, f'{name}.npy'))
+                  for name in ['centroid_numerics', 'centroid_categories', 'ids', 'lists']]
+        return cls(index_dir, meta, *arrays)
+
+    @classmethod
+    def train(cls, index_dir, store, catalog, num_lists=None):
+        """Cluster the store's embedding and assign every catalog row to a list"""
+        num_rows = len(store)
+        num_lists = num_lists or int(np.clip(round(np.sqrt(num_rows)), 1, MAX_LISTS))
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(num_rows, min(num_rows, KMEANS_SAMPLE_ROWS), replace=False))
+        centroids = kmeans(store.embedding[sample], min(num_lists, len(sample)))
+        lists = nearest_centroids(store.embedding, centroids)
+
+        # Undo the store's scaling and weighting so the centroids stay valid
+        # when the scaler is refit: numerics in raw units, categoricals as the
+        # share of each value among the cluster's rows.
+        numeric_weights = np.sqrt(store.weights[NUMERIC_INDEX])
+        centroid_numerics = centroids[:, :len(NUMERIC_INDEX)] / numeric_weights * store.scale + store.mean
+        vocabularies = {}
+        blocks = []
+        for feature, j in zip(CATEGORICAL_FEATURES, CATEGORICAL_INDEX):
+            vocabulary = sorted(store.vocabularies[feature], key=store.vocabularies[feature].get)
+            offset = store.category_offsets[feature]
+            blocks.append(centroids[:, offset:offset + len(vocabulary)] / np.sqrt(store.weights[j] / 2))
+            vocabularies[feature] = vocabulary
+        meta = {
+            'format_version': ANN_FORMAT_VERSION,
+            'vocabularies': vocabularies,
+            'trained_rows': num_rows,
+            'trained_at': time.time(),
+            'catalog_version': catalog.signature[0]
+        }
+        index = cls(index_dir, meta, centroid_numerics, np.hstack(blocks), catalog.ids.astype(np.int64), lists)
+        index.save()
+        index.prepare(store)
+        return index
+
+    def save(self):
+        """Write a new build and point CURRENT at it; the caller holds build_lock(self.path)"""
+        build_name = f"v{ANN_FORMAT_VERSION}-{uuid.uuid4().hex[:12]}"
+        build_dir = os.path.join(self.path, build_name)
+        os.makedirs(build_dir)
+        for name in ['centroid_numerics', 'centroid_categories', 'ids', 'lists']:
+            np.save(os.path.join(build_dir, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(build_dir, 'meta.json'), 'w') as f:
+            self.meta['saved_at'] = time.time()
+            json.dump(self.meta, f)
+        publish_build(self.path, build_name)
+
+    def centroids_for(self, store):
+        """Centroids mapped into the embedding space of the given feature store build"""
+        centroids = np.zeros((self.num_lists, store.embedding.shape[1]))
+        numeric_weights = np.sqrt(store.weights[NUMERIC_INDEX])
+        centroids[:, :len(NUMERIC_INDEX)] = numeric_weights * (self.centroid_numerics - store.mean) / store.scale
+        column = 0
+        for feature, j in zip(CATEGORICAL_FEATURES, CATEGORICAL_INDEX):
+            for value in self.meta['vocabularies'][feature]:
+                code = store.vocabularies[feature].get(value)
+                if code is not None:
+                    centroids[:, store.category_offsets[feature] + code] = (
+                        self.centroid_categories[:, column] * np.sqrt(store.weights[j] / 2)
+                    )
+                column += 1
+        return centroids
+
+    def sync(self, store, catalog, changes=None):
+        """Reassign changed catalog rows to their nearest lists and drop deleted ones.
+
+        ``changes`` is the catalog changelog since the index was last saved;
+        without it the index diffs its ids against the whole catalog, which
+        also catches new and deleted rows but not updated ones. Returns False
+        when the catalog has outgrown the trained centroids and the index
+        should be retrained instead.
+        """
+        catalog_ids = catalog.ids.astype(np.int64)
+        if changes is None:
+            upserted = catalog_ids[~np.isin(catalog_ids, self.ids)]
+            deleted = self.ids[~np.isin(self.ids, catalog_ids)]
+        else:
+            upserted, deleted = (np.array(sorted(ids), dtype=np.int64) for ids in net_changes(changes))
+        if len(upserted) or len(deleted):
+            if len(catalog_ids) > (1 + RETRAIN_GROWTH) * self.meta['trained_rows']:
+                return False
+            keep = ~np.isin(self.ids, np.concatenate([upserted, deleted]))
+            # The changelog can run ahead of this catalog snapshot; rows it
+            # does not have yet are picked up again on the next sync.
+            rows = np.searchsorted(catalog_ids, upserted)
+            rows = rows[catalog_ids[np.minimum(rows, len(catalog_ids) - 1)] == upserted]
+            new_lists = nearest_centroids(store.embedding[rows], self.centroids_for(store))
+            ids = np.concatenate([self.ids[keep], catalog_ids[rows]])
+            lists = np.concatenate([self.lists[keep], new_lists])
+            order = np.argsort(ids, kind='stable')
+            self.ids, self.lists = ids[order], lists[order]
+        if not np.array_equal(self.ids, catalog_ids):
+            if changes is None:
+                return False
+            return self.sync(store, catalog)
+        if self.meta.get('catalog_version') != catalog.signature[0]:
+            self.meta['catalog_version'] = catalog.signature[0]
+            self.save()
+        self.prepare(store)
+        return True
+
+    def prepare(self, store):
+        # Rows grouped by list, ascending within each list.
+        self.list_rows = np.argsort(self.lists, kind='stable')
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(self.lists, minlength=self.num_lists))])
+        self.centroids = self.centroids_for(store)
+        self.centroid_norms = np.sqrt((self.centroids * self.centroids).sum(axis=1))
+        self.build_path = store.path
+
+    def search(self, query, kernel, min_candidates, num_probes=NUM_PROBES):
+        """Sorted catalog rows of the lists closest to a kernel_query(), at least min_candidates of them"""
+        embedding = query['embedding']
+        if kernel == 'cosine':
+            dots = self.centroids @ embedding
+            closeness = np.divide(dots, self.centroid_norms, out=np.zeros(len(dots)), where=self.centroid_norms > 0)
+        else:
+            diff = self.centroids - embedding
+            closeness = -(diff * diff).sum(axis=1)
+        order = np.argsort(-closeness, kind='stable')
+        sizes = np.cumsum(np.diff(self.list_offsets)[order])
+        probes = max(num_probes, int(np.searchsorted(sizes, min_candidates)) + 1)
+        rows = [self.list_rows[self.list_offsets[l]:self.list_offsets[l + 1]] for l in order[:probes]]
+        return np.sort(np.concatenate(rows))
+
+
+_indexes = {}
+
+
+def load_ann_index(db_path, store, catalog):
+    """ANN index in sync with the given feature store build, updating or training it as needed"""
+    index = _indexes.get(db_path)
+    if index is not None and index.build_path == store.path:
+        return index
+    index_dir = ann_index_path(db_path)
+    # Workers share the index directory, so syncing and training take turns;
+    # whoever comes second loads the first one's saved index.
+    with build_lock(index_dir):
+        try:
+            saved = IVFIndex.load(index_dir)
+        except (OSError, ValueError, KeyError):
+            saved = None
+        if saved is not None and (index is None or saved.meta['saved_at'] > index.meta.get('saved_at', 0)):
+            index = saved
+        if index is not None:
+            # Replay the changelog since the index was saved, so updated rows
+            # move to their new nearest list too; None falls back to diffing ids.
+            changes = watch_catalog(db_path).changes_since(index.meta.get('catalog_version', -1))
+            if not index.sync(store, catalog, changes):
+                index = None
+        if index is None:
+            print(f"Training ANN index for {len(catalog)} phones")
+            index = IVFIndex.train(index_dir, store, catalog)
+    _indexes[db_path] = index
+    return index
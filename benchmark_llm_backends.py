@@ -0,0 +1,69 @@
+import argparse
+import time
+import numpy as np
+from local_llm_client import RemoteLLMRecommender
+from mobile_catalog import load_catalog, sample_profiles
+
+
+def run_backend(url, mobile_database, profiles, num_recommendations, max_new_tokens, timeout):
+    """Latency of each /recommend call and the generation stats the service reported"""
+    import requests
+    url = url.rstrip('/')
+    health = requests.get(f"{url}/health", timeout=timeout).json()
+    latencies = []
+    generations = []
+    successes = 0
+    for i, prefs in enumerate(profiles):
+        request_data = {
+            'user_preferences': prefs,
+            'mobile_database': mobile_database,
+            'num_recommendations': num_recommendations
+        }
+        if max_new_tokens is not None:
+            request_data['max_new_tokens'] = max_new_tokens
+        start = time.perf_counter()
+        response = requests.post(f"{url}/recommend", json=request_data, timeout=timeout)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        result = response.json() if response.status_code == 200 else {}
+        # The first request pays for loading the catalog prompt into the KV cache.
+        if i == 0:
+            continue
+        latencies.append(elapsed_ms)
+        successes += bool(result.get('success'))
+        # Answers that fail to parse still measure generation speed.
+        if 'generation' in result:
+            generations.append(result['generation'])
+    return health, latencies, generations, successes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare tokens/s and end-to-end latency of LLM services implementing /health and /recommend"
+    )
+    parser.add_argument('backends', nargs='+', metavar='LABEL=URL',
+                        help="e.g. fp16=https://<colab>.ngrok.app q4=http://localhost:5000")
+    parser.add_argument('--db', default='mobile_recommendations.db')
+    parser.add_argument('--requests', type=int, default=10, help="timed requests per backend, after one warm-up")
+    parser.add_argument('--num-recommendations', type=int, default=2)
+    parser.add_argument('--max-new-tokens', type=int)
+    parser.add_argument('--timeout', type=float, default=600)
+    args = parser.parse_args()
+
+    catalog = load_catalog(args.db)
+    mobile_database = RemoteLLMRecommender.format_mobile_database_for_llm(catalog)
+    profiles = sample_profiles(catalog, args.requests + 1)
+
+    print(f"{'backend':<10} {'model':<40} {'ok':>6} {'p50 ms':>9} {'p95 ms':>9} {'tokens/s':>9} {'ms/token':>9}")
+    for backend in args.backends:
+        label, url = backend.split('=', 1)
+        health, latencies, generations, successes = run_backend(
+            url, mobile_database, profiles, args.num_recommendations, args.max_new_tokens, args.timeout
+        )
+        ok = f"{successes}/{len(latencies)}"
+        p50, p95 = np.percentile(latencies, [50, 95])
+        new_tokens = sum(g['new_tokens'] for g in generations)
+        seconds = sum(g['seconds'] for g in generations)
+        tokens_per_second = new_tokens / seconds if seconds else float('nan')
+        ms_per_token = seconds * 1000 / new_tokens if new_tokens else float('nan')
+        print(f"{label:<10} {health.get('model', '?'):<40} {ok:>6} {p50:9.0f} {p95:9.0f} "
+              f"{tokens_per_second:9.1f} {ms_per_token:9.1f}")
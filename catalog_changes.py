@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import threading
+from mobile_dss_database import ensure_catalog_versioning
+
+
+def catalog_version(conn):
+    return conn.execute("SELECT version FROM catalog_version WHERE id = 1").fetchone()[0]
+
+
+def changes_since(conn, version):
+    """(row_id, operation) for each mobile_data change after version, or None if the changelog no longer covers it"""
+    current = catalog_version(conn)
+    if current == version:
+        return []
+    rows = conn.execute(
+        "SELECT row_id, operation FROM catalog_changelog WHERE version > ? ORDER BY version", (version,)
+    ).fetchall()
+    # Versions are consecutive, so missing rows mean the changelog was pruned
+    # (or the database replaced) and the caller has to start from scratch.
+    if len(rows) != current - version:
+        return None
+    return rows
+
+
+def net_changes(changes):
+    """Collapse a change list into the sets of row ids that now exist with new values and that were deleted"""
+    upserted = set()
+    deleted = set()
+    for row_id, operation in changes:
+        if operation == 'delete':
+            upserted.discard(row_id)
+            deleted.add(row_id)
+        else:
+            deleted.discard(row_id)
+            upserted.add(row_id)
+    return upserted, deleted
+
+
+class CatalogWatcher:
+    """Change feed for mobile_data, driven by the trigger-maintained catalog version.
+
+    ``poll()`` reads the single catalog_version row; only when it has moved
+    are the changelog rows since the previous poll read and passed to every
+    subscriber as ``callback(previous_version, version, changes)``, where
+    ``changes`` is a list of (row_id, operation) or None when subscribers
+    have to reload everything.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.subscribers = []
+        self.lock = threading.Lock()
+        # sqlite3.connect would create an empty file for a missing database.
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"No catalog database at {db_path}; run mobile_dss_database.py to create it")
+        conn = sqlite3.connect(db_path)
+        try:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            if 'mobile_data' not in tables:
+                raise sqlite3.OperationalError(
+                    f"{db_path} has no mobile_data table; run mobile_dss_database.py to create it"
+                )
+            # create_database and the feed ingest set up versioning; only a
+            # database written before it existed is upgraded here, once.
+            if 'catalog_version' not in tables:
+                ensure_catalog_versioning(conn)
+            self.version = catalog_version(conn)
+        finally:
+            conn.close()
+
+    def subscribe(self, callback):
+        with self.lock:
+            self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def poll(self):
+        """Current catalog version, notifying subscribers first if it changed since the last poll"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                version = catalog_version(conn)
+                if version == self.version:
+                    return version
+                changes = changes_since(conn, self.version)
+            finally:
+                conn.close()
+            previous, self.version = self.version, version
+            subscribers = list(self.subscribers)
+        for callback in subscribers:
+            callback(previous, version, changes)
+        return version
+
+    def changes_since(self, version):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return changes_since(conn, version)
+        finally:
+            conn.close()
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def watch_catalog(db_path='mobile_recommendations.db'):
+    """Shared CatalogWatcher for db_path"""
+    with _watchers_lock:
+        watcher = _watchers.get(db_path)
+        if watcher is None:
+            watcher = _watchers[db_path] = CatalogWatcher(db_path)
+        return watcher
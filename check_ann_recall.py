@@ -0,0 +1,41 @@
+import sys
+import time
+import numpy as np
+from expert_system import MobileExpertSystem
+from mobile_catalog import sample_profiles
+
+MIN_RECALL = 0.95
+
+
+def recall_at_k(db_path, num_profiles=100, k=8, kernel='cosine'):
+    """Mean recall@k and per-query latency of the ANN path against the exact scan"""
+    exact = MobileExpertSystem(db_path, kernel=kernel, ann_min_rows=None)
+    approximate = MobileExpertSystem(db_path, kernel=kernel, ann_min_rows=0)
+    exact.load_data()
+    profiles = sample_profiles(exact.catalog, num_profiles)
+    approximate.get_expert_recommendations(profiles[0], k)
+
+    recalls = []
+    exact_ms = approximate_ms = 0.0
+    for prefs in profiles:
+        start = time.perf_counter()
+        expected = {rec.index for rec in exact.get_expert_recommendations(prefs, k)}
+        exact_ms += (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        found = {rec.index for rec in approximate.get_expert_recommendations(prefs, k)}
+        approximate_ms += (time.perf_counter() - start) * 1000
+        recalls.append(len(expected & found) / len(expected))
+    return float(np.mean(recalls)), exact_ms / num_profiles, approximate_ms / num_profiles
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'mobile_recommendations.db'
+    num_profiles = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    k = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+    failed = False
+    for kernel in ['cosine', 'euclidean', 'gower']:
+        recall, exact_ms, approximate_ms = recall_at_k(db_path, num_profiles, k, kernel)
+        status = 'OK' if recall >= MIN_RECALL else 'FAIL'
+        failed = failed or recall < MIN_RECALL
+        print(f"{status:<4} {kernel:<10} recall@{k} {recall:.3f}  exact {exact_ms:7.1f} ms  ann {approximate_ms:7.1f} ms")
+    sys.exit(1 if failed else 0)
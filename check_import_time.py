@@ -0,0 +1,76 @@
+import importlib.util
+import subprocess
+import sys
+
+# Cold-import budgets in milliseconds, measured with `python -X importtime`.
+IMPORT_BUDGETS_MS = {
+    'expert_system': 800,
+    'local_llm_client': 300,
+    'mobile_dss_database': 50,
+    'streamlit_app': 1500,
+    'tracing': 50
+}
+
+# Modules measured only when the package they are built on is installed.
+OPTIONAL_MODULES = {
+    'streamlit_app': 'streamlit'
+}
+
+# Heavy dependencies each module must only load on demand.
+LAZY_DEPENDENCIES = {
+    'expert_system': ['sklearn', 'plotly', 'requests'],
+    'local_llm_client': ['sklearn', 'plotly', 'requests', 'pandas'],
+    'mobile_dss_database': ['pandas', 'sklearn'],
+    # streamlit registers its plotly theme on import, so plotly is not listed.
+    'streamlit_app': ['sklearn', 'requests'],
+    'tracing': ['urllib.request']
+}
+
+
+def measure_import(module):
+    """Cumulative import time of module in ms and the set of modules it pulled in"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    total_us = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        imported.add(name.strip())
+        if name.strip() == module and not name.startswith('  '):
+            total_us = int(cumulative)
+    return total_us / 1000, imported
+
+
+def check_import_budgets(budgets=IMPORT_BUDGETS_MS, lazy=LAZY_DEPENDENCIES):
+    failures = []
+    for module, budget_ms in budgets.items():
+        requirement = OPTIONAL_MODULES.get(module)
+        if requirement and importlib.util.find_spec(requirement) is None:
+            print(f"SKIP {module:<24} {requirement} is not installed")
+            continue
+        # Take the best of a few runs so a cold disk cache does not fail the check.
+        runs = [measure_import(module) for _ in range(3)]
+        elapsed_ms = min(run[0] for run in runs)
+        eager = [dep for dep in lazy.get(module, []) if dep in runs[0][1]]
+        status = 'OK' if elapsed_ms <= budget_ms and not eager else 'FAIL'
+        print(f"{status:<4} {module:<24} {elapsed_ms:8.1f} ms (budget {budget_ms} ms)")
+        if elapsed_ms > budget_ms:
+            failures.append(f"{module} took {elapsed_ms:.1f} ms, budget is {budget_ms} ms")
+        if eager:
+            failures.append(f"{module} imports {', '.join(eager)} at import time")
+    return failures
+
+
+if __name__ == "__main__":
+    failures = check_import_budgets()
+    for failure in failures:
+        print(failure)
+    sys.exit(1 if failures else 0)
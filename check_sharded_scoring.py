@@ -0,0 +1,69 @@
+import sys
+import numpy as np
+from expert_system import MobileExpertSystem
+from mobile_catalog import sample_profiles
+from scoring import ShardedScorer, score_rows, top_k_indices, merge_top_k
+
+
+def same_top_k(expected, found):
+    return np.array_equal(expected[0], found[0]) and np.array_equal(expected[1], found[1], equal_nan=True)
+
+
+def check_merge(num_rows=1000, num_shards=7, seed=0):
+    """merge_top_k over per-shard top-k against top_k_indices over all rows, with ties and NaN scores"""
+    rng = np.random.default_rng(seed)
+    scorer = ShardedScorer(num_shards, min_rows_per_shard=1)
+    failures = []
+    # Few distinct values make ties span shard boundaries; NaN must rank last.
+    for label, final in [('ties', rng.integers(0, 5, num_rows).astype(float)),
+                         ('nan', np.where(rng.random(num_rows) < 0.3, np.nan, rng.random(num_rows))),
+                         ('all nan', np.full(num_rows, np.nan))]:
+        scores = np.column_stack([final, final, final, final])
+        for k in [1, 8, num_rows // num_shards + 1, num_rows, num_rows + 5]:
+            expected = top_k_indices(final, k)
+            expected = expected, scores[expected]
+            indices, shard_scores = [], []
+            for start, stop in scorer.shards(num_rows):
+                local = top_k_indices(final[start:stop], k)
+                indices.append(local + start)
+                shard_scores.append(scores[start:stop][local])
+            found = merge_top_k(np.concatenate(indices), np.concatenate(shard_scores), k)
+            if not same_top_k(expected, found):
+                failures.append(f"merge_top_k differs from top_k_indices for {label} scores, k={k}")
+    return failures
+
+
+def check_sharded(db_path, num_profiles=50, num_workers=4, kernel='cosine'):
+    """ShardedScorer.score_top_k with one-row minimum shards against score_rows and top_k_indices"""
+    expert_system = MobileExpertSystem(db_path, kernel=kernel, ann_min_rows=None)
+    expert_system.load_data()
+    expert_system.preprocess_data()
+    store = expert_system.feature_store
+    scorer = ShardedScorer(num_workers, min_rows_per_shard=1)
+    failures = []
+    try:
+        for prefs in sample_profiles(expert_system.catalog, num_profiles):
+            query = expert_system.build_scoring_query(prefs)
+            scores = score_rows(store, query)
+            for k in [1, 8, len(store)]:
+                expected = top_k_indices(scores[:, 3], k)
+                if not same_top_k((expected, scores[expected]), scorer.score_top_k(store, query, k)):
+                    failures.append(f"{kernel} sharded top-{k} differs for {prefs}")
+    finally:
+        scorer.close()
+        expert_system.close()
+    return failures
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'mobile_recommendations.db'
+    num_profiles = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    failures = check_merge()
+    print(f"{'FAIL' if failures else 'OK':<4} merge_top_k with ties and NaN")
+    for kernel in ['cosine', 'euclidean', 'gower']:
+        kernel_failures = check_sharded(db_path, num_profiles, kernel=kernel)
+        print(f"{'FAIL' if kernel_failures else 'OK':<4} {kernel:<10} sharded scoring over {num_profiles} profiles")
+        failures += kernel_failures
+    for failure in failures[:10]:
+        print(failure)
+    sys.exit(1 if failures else 0)
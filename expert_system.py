@@ -1,132 +1,165 @@
 import sqlite3
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import LabelEncoder, StandardScaler
 import numpy as np
-from collections import Counter
+from mobile_catalog import load_catalog
+from feature_store import (load_feature_store, CATEGORICAL_FEATURES, NUMERIC_FEATURES, DEFAULT_FEATURE_WEIGHTS,
+                           KERNELS)
+from preference_model import OnlinePreferenceModel
+from tracing import span, timed, profile
+from scoring import ShardedScorer, score_rows, score_candidates, score_batch, top_k_indices, BATCH_CELLS
+from ann_index import load_ann_index, ANN_MIN_ROWS, ANN_CANDIDATE_FACTOR
 import warnings
 warnings.filterwarnings('ignore')
 
 class MobileExpertSystem:
-    def __init__(self, db_path='mobile_recommendations.db'):
+    def __init__(self, db_path='mobile_recommendations.db', num_workers=0, kernel='cosine', ann_min_rows=ANN_MIN_ROWS):
+        if kernel not in KERNELS:
+            raise ValueError(f"Unknown similarity kernel {kernel!r}, expected one of {KERNELS}")
         self.db_path = db_path
-        self.label_encoders = {}
-        self.scaler = StandardScaler()
-        self.feature_weights = {
-            'price_range': 0.25,
-            'ram': 0.20,
-            'storage': 0.15,
-            'camera_mp': 0.15,
-            'battery_mah': 0.10,
-            'screen_size': 0.05,
-            'operating_system': 0.05,
-            'processor_type': 0.03,
-            'network_type': 0.02
-        }
+        self.kernel = kernel
+        self.feature_store = None
+        self.preference_model = None
+        self.ann_index = None
+        self.ann_min_rows = ann_min_rows
+        self.sharded_scorer = ShardedScorer(num_workers) if num_workers else None
+        self.feature_weights = dict(DEFAULT_FEATURE_WEIGHTS)
         
     def load_data(self):
-        conn = sqlite3.connect(self.db_path)
-        self.mobile_data = pd.read_sql_query("SELECT * FROM mobile_data", conn)
-        self.user_choices = pd.read_sql_query("SELECT * FROM user_choices", conn)
-        conn.close()
+        self.catalog = load_catalog(self.db_path)
+        if self.preference_model is None:
+            self.preference_model = OnlinePreferenceModel(self.db_path, self.feature_weights)
         
     def preprocess_data(self):
-        all_data = pd.concat([
-            self.mobile_data[['price_range', 'ram', 'storage', 'camera_mp', 'battery_mah', 
-                             'screen_size', 'operating_system', 'processor_type', 'network_type']],
-            self.user_choices[['price_range', 'ram', 'storage', 'camera_mp', 'battery_mah', 
-                              'screen_size', 'operating_system', 'processor_type', 'network_type']]
-        ], ignore_index=True)
-        
-        categorical_cols = ['price_range', 'operating_system', 'processor_type', 'network_type']
-        
-        for col in categorical_cols:
-            le = LabelEncoder()
-            all_data[col + '_encoded'] = le.fit_transform(all_data[col].astype(str))
-            self.label_encoders[col] = le
-        
-        feature_cols = ['price_range_encoded', 'ram', 'storage', 'camera_mp', 'battery_mah', 
-                       'screen_size', 'operating_system_encoded', 'processor_type_encoded', 
-                       'network_type_encoded']
-        
-        self.scaler.fit(all_data[feature_cols])
+        self.feature_store = load_feature_store(self.db_path, self.catalog, feature_weights=self.feature_weights)
+        with span('expert.preference_sync'):
+            self.preference_model.sync(self.catalog, self.feature_store)
+        # ann_min_rows=None always scans the whole catalog exactly.
+        if self.ann_min_rows is not None and len(self.catalog) >= self.ann_min_rows:
+            with span('expert.ann_sync'):
+                self.ann_index = load_ann_index(self.db_path, self.feature_store, self.catalog)
+        else:
+            self.ann_index = None
         
     def calculate_similarity_score(self, user_preferences, mobile_specs):
-        user_encoded = []
-        mobile_encoded = []
-        
-        features = ['price_range', 'ram', 'storage', 'camera_mp', 'battery_mah', 
-                   'screen_size', 'operating_system', 'processor_type', 'network_type']
-        
-        for feature in features:
-            if feature in ['price_range', 'operating_system', 'processor_type', 'network_type']:
-                try:
-                    user_val = self.label_encoders[feature].transform([str(user_preferences[feature])])[0]
-                    mobile_val = self.label_encoders[feature].transform([str(mobile_specs[feature])])[0]
-                except:
-                    user_val = 0
-                    mobile_val = 0
-            else:
-                user_val = float(user_preferences[feature])
-                mobile_val = float(mobile_specs[feature])
-            
-            user_encoded.append(user_val)
-            mobile_encoded.append(mobile_val)
-        
-        user_array = np.array(user_encoded).reshape(1, -1)
-        mobile_array = np.array(mobile_encoded).reshape(1, -1)
-        
-        user_normalized = self.scaler.transform(user_array)
-        mobile_normalized = self.scaler.transform(mobile_array)
-        
-        similarity = cosine_similarity(user_normalized, mobile_normalized)[0][0]
-        
-        return similarity
+        return self.feature_store.pair_similarity(self.kernel_query(user_preferences), mobile_specs, self.kernel)
+    
+    def kernel_query(self, user_preferences):
+        # The segment's learned weights only rescale the query vectors, the
+        # catalog side keeps the weights it was built with.
+        return self.feature_store.kernel_query(user_preferences, self.preference_model.weights_for(user_preferences))
     
     def get_expert_recommendations(self, user_preferences, num_recommendations=8):
+        with profile('expert_recommendations'), span('expert.recommend', num_recommendations=num_recommendations):
+            with span('expert.load_data'):
+                self.load_data()
+            with span('expert.preprocess'):
+                self.preprocess_data()
+            
+            query = self.build_scoring_query(user_preferences)
+            if self.ann_index is not None:
+                with span('expert.ann_candidates'):
+                    candidates = self.ann_index.search(query['kernel_query'], self.kernel,
+                                                       num_recommendations * ANN_CANDIDATE_FACTOR)
+                scores = score_candidates(self.feature_store, query, candidates)
+                with span('expert.ranking'):
+                    local = top_k_indices(scores[:, 3], num_recommendations)
+                    ranked, ranked_scores = candidates[local], scores[local]
+            elif self.sharded_scorer is not None:
+                with span('expert.sharded_scoring', workers=self.sharded_scorer.num_workers):
+                    ranked, ranked_scores = self.sharded_scorer.score_top_k(self.feature_store, query, num_recommendations)
+            else:
+                scores = score_rows(self.feature_store, query)
+                with span('expert.ranking'):
+                    ranked = top_k_indices(scores[:, 3], num_recommendations)
+                    ranked_scores = scores[ranked]
+            return [self.catalog.record(i, self.score_breakdown(row)) for i, row in zip(ranked, ranked_scores)]
+    
+    @timed('expert.batch_recommend')
+    def get_batch_recommendations(self, profiles, num_recommendations=8):
+        """Top recommendations for each preference profile (DataFrame, records or structured array)"""
         self.load_data()
         self.preprocess_data()
         
-        recommendations = []
+        profiles = profiles if isinstance(profiles, pd.DataFrame) else pd.DataFrame(profiles)
+        profiles = profiles.reset_index(drop=True)
+        if profiles.empty:
+            return []
+        batch = self.build_batch_query(profiles)
+        results = []
         
-        for _, mobile in self.mobile_data.iterrows():
-            mobile_specs = {
-                'price_range': mobile['price_range'],
-                'ram': mobile['ram'],
-                'storage': mobile['storage'],
-                'camera_mp': mobile['camera_mp'],
-                'battery_mah': mobile['battery_mah'],
-                'screen_size': mobile['screen_size'],
-                'operating_system': mobile['operating_system'],
-                'processor_type': mobile['processor_type'],
-                'network_type': mobile['network_type']
-            }
-            
-            similarity_score = self.calculate_similarity_score(user_preferences, mobile_specs)
-            rule_bonus = self.apply_expert_rules(user_preferences, mobile_specs)
-            historical_bonus = self.calculate_historical_preference_bonus(user_preferences, mobile['brand'])
-            final_score = similarity_score + rule_bonus + historical_bonus
-            
-            recommendations.append({
-                'brand': mobile['brand'],
-                'model': mobile['model'],
-                'price_range': mobile['price_range'],
-                'ram': mobile['ram'],
-                'storage': mobile['storage'],
-                'camera_mp': mobile['camera_mp'],
-                'battery_mah': mobile['battery_mah'],
-                'screen_size': mobile['screen_size'],
-                'operating_system': mobile['operating_system'],
-                'processor_type': mobile['processor_type'],
-                'network_type': mobile['network_type'],
-                'similarity_score': similarity_score,
-                'rule_bonus': rule_bonus,
-                'historical_bonus': historical_bonus,
-                'final_score': final_score
-            })
+        chunk_size = max(1, BATCH_CELLS // max(len(self.catalog), 1))
+        for start in range(0, len(profiles), chunk_size):
+            scores = score_batch(self.feature_store, self.take_batch(batch, slice(start, start + chunk_size)))
+            for row in range(len(scores[3])):
+                ranked = top_k_indices(scores[3][row], num_recommendations)
+                results.append([self.catalog.record(i, self.score_breakdown([s[row, i] for s in scores]))
+                                for i in ranked])
+        return results
+    
+    def build_batch_query(self, profiles):
+        store = self.feature_store
+        codes = {feature: np.nan_to_num(
+            profiles[feature].astype(str).map(store.vocabularies[feature]).to_numpy(dtype=np.float64), nan=-1
+        ) for feature in CATEGORICAL_FEATURES}
+        numerics = profiles[NUMERIC_FEATURES].to_numpy(dtype=np.float64)
         
-        recommendations.sort(key=lambda x: x['final_score'], reverse=True)
-        return recommendations[:num_recommendations]
+        network_5g_code = store.vocabularies['network_type'].get('5G', -1)
+        segments = profiles['price_range'].astype(str) + '|' + profiles['operating_system'].astype(str)
+        segment_ids, unique_segments = pd.factorize(segments)
+        first_rows = pd.Series(np.arange(len(profiles))).groupby(segment_ids).first()
+        segment_bonus = np.array([
+            self.historical_bonus_by_brand(profiles.iloc[p], store.meta['brand_vocabulary'])
+            for p in first_rows.to_numpy()
+        ]).reshape(len(unique_segments), -1)
+        segment_weights = np.array([
+            self.preference_model.weights_for(profiles.iloc[p]) for p in first_rows.to_numpy()
+        ]).reshape(len(unique_segments), -1)
+        
+        return {
+            'kernel': self.kernel,
+            'kernel_queries': store.kernel_queries(
+                numerics, np.column_stack([codes[f] for f in CATEGORICAL_FEATURES]), segment_weights[segment_ids]
+            ),
+            'price_code': codes['price_range'][:, None],
+            'os_code': codes['operating_system'][:, None],
+            'network_5g_code': np.where(profiles['network_type'].to_numpy() == '5G', network_5g_code, -1)[:, None],
+            'numeric_preferences': {f: numerics[:, k, None] for k, f in enumerate(NUMERIC_FEATURES)},
+            'brand_bonus': segment_bonus[segment_ids]
+        }
+    
+    @staticmethod
+    def take_batch(batch, rows):
+        taken = {}
+        for key, value in batch.items():
+            if isinstance(value, dict):
+                taken[key] = {name: column[rows] for name, column in value.items()}
+            else:
+                taken[key] = value if isinstance(value, str) else value[rows]
+        return taken
+    
+    def build_scoring_query(self, user_preferences):
+        store = self.feature_store
+        network_5g_code = -1
+        if user_preferences['network_type'] == '5G':
+            network_5g_code = store.vocabularies['network_type'].get('5G', -1)
+        return {
+            'kernel': self.kernel,
+            'kernel_query': self.kernel_query(user_preferences),
+            'price_code': store.vocabularies['price_range'].get(str(user_preferences['price_range']), -1),
+            'os_code': store.vocabularies['operating_system'].get(str(user_preferences['operating_system']), -1),
+            'network_5g_code': network_5g_code,
+            'numeric_preferences': {f: float(user_preferences[f]) for f in NUMERIC_FEATURES},
+            'brand_bonus': self.historical_bonus_by_brand(user_preferences, store.meta['brand_vocabulary'])
+        }
+    
+    @staticmethod
+    def score_breakdown(row):
+        return {
+            'similarity_score': float(row[0]),
+            'rule_bonus': float(row[1]),
+            'historical_bonus': float(row[2]),
+            'final_score': float(row[3])
+        }
     
     def apply_expert_rules(self, user_prefs, mobile_specs):
         bonus = 0.0
@@ -158,27 +191,20 @@ class MobileExpertSystem:
         return bonus
     
     def calculate_historical_preference_bonus(self, user_prefs, brand):
-        if self.user_choices.empty:
-            return 0.0
-        
-        similar_users = self.user_choices[
-            (self.user_choices['price_range'] == user_prefs['price_range']) |
-            (self.user_choices['operating_system'] == user_prefs['operating_system'])
-        ]
-        
-        if similar_users.empty:
-            return 0.0
-        
-        brand_counts = Counter(similar_users['chosen_brand'])
-        total_similar_choices = len(similar_users)
-        
-        if brand in brand_counts:
-            brand_preference_ratio = brand_counts[brand] / total_similar_choices
-            return brand_preference_ratio * 0.1
-        
-        return 0.0
+        return float(self.preference_model.historical_bonus_by_brand(user_prefs, [brand])[0])
+    
+    @timed('expert.historical_bonus')
+    def historical_bonus_by_brand(self, user_prefs, brands):
+        return self.preference_model.historical_bonus_by_brand(user_prefs, brands)
     
-    def save_user_choice(self, user_preferences, chosen_mobile):
+    def close(self):
+        if self.sharded_scorer is not None:
+            self.sharded_scorer.close()
+        if self.preference_model is not None:
+            self.preference_model.snapshot()
+    
+    @timed('expert.save_choice')
+    def save_user_choice(self, user_preferences, chosen_mobile, source='Expert System'):
         choice_data = (
             user_preferences['price_range'],
             user_preferences['ram'],
@@ -191,7 +217,7 @@ class MobileExpertSystem:
             user_preferences['network_type'],
             chosen_mobile['brand'],
             chosen_mobile['model'],
-            'Expert System'
+            source
         )
         
         conn = sqlite3.connect(self.db_path)
@@ -206,6 +232,9 @@ class MobileExpertSystem:
         
         conn.commit()
         conn.close()
+        
+        if self.preference_model is not None:
+            self.preference_model.sync(self.catalog, self.feature_store)
 
 if __name__ == "__main__":
     expert_system = MobileExpertSystem()
@@ -0,0 +1,75 @@
+import numpy as np
+from mobile_catalog import INTEGER_COLUMNS
+
+FALLBACK_DEPTH = 20
+
+
+class FallbackRanking:
+    """Expert-ranked phones per (price_range, operating_system) segment for the LLM fallback.
+
+    Every combination of a catalog price range and OS, with None standing in
+    for "any", gets one representative profile scored by the expert system
+    ahead of time, so a fallback is a dict lookup and a slice. The ranking
+    keeps the catalog it was built from, since its indices only hold there.
+    """
+
+    def __init__(self, catalog, rankings):
+        self.catalog = catalog
+        self.signature = catalog.signature
+        self.rankings = rankings
+        self.price_ranges = {key[0] for key in rankings if key[0] is not None}
+        self.operating_systems = {key[1] for key in rankings if key[1] is not None}
+
+    @classmethod
+    def build(cls, expert_system, depth=FALLBACK_DEPTH):
+        expert_system.load_data()
+        catalog = expert_system.catalog
+        if catalog.empty:
+            return cls(catalog, {(None, None): np.array([], dtype=np.int64)})
+        price_codes = catalog.codes['price_range']
+        os_codes = catalog.codes['operating_system']
+        keys = [(price, operating_system)
+                for price in [None, *range(len(catalog.vocabularies['price_range']))]
+                for operating_system in [None, *range(len(catalog.vocabularies['operating_system']))]]
+        profiles = []
+        for price, operating_system in keys:
+            price_mask = price_codes == price if price is not None else np.ones(len(catalog), dtype=bool)
+            os_mask = os_codes == operating_system if operating_system is not None else np.ones(len(catalog), dtype=bool)
+            # Segments with no phones borrow their typical specs from the
+            # closest wider segment, but keep their own price range and OS.
+            for mask in [price_mask & os_mask, price_mask, os_mask, np.ones(len(catalog), dtype=bool)]:
+                if mask.any():
+                    break
+            profiles.append(cls.segment_profile(catalog, mask, price, operating_system))
+
+        recommendations = expert_system.get_batch_recommendations(profiles, depth)
+        rankings = {}
+        for (price, operating_system), ranked in zip(keys, recommendations):
+            key = (catalog.vocabularies['price_range'][price] if price is not None else None,
+                   catalog.vocabularies['operating_system'][operating_system] if operating_system is not None else None)
+            rankings[key] = np.array([rec.index for rec in ranked], dtype=np.int64)
+        return cls(catalog, rankings)
+
+    @staticmethod
+    def segment_profile(catalog, mask, price, operating_system):
+        """Median specs and most common processor and network of the masked phones"""
+        profile = {}
+        for col in INTEGER_COLUMNS:
+            profile[col] = int(np.median(catalog.column(col)[mask]))
+        profile['screen_size'] = round(float(np.median(catalog.column('screen_size')[mask])), 2)
+        for col, code in [('price_range', price), ('operating_system', operating_system),
+                          ('processor_type', None), ('network_type', None)]:
+            if code is None:
+                code = int(np.bincount(catalog.codes[col][mask]).argmax())
+            profile[col] = str(catalog.vocabularies[col][code])
+        return profile
+
+    def lookup(self, price_range, operating_system):
+        """Ranked catalog indices for the segment; unknown values fall back to "any" """
+        price_range = price_range if price_range in self.price_ranges else None
+        operating_system = operating_system if operating_system in self.operating_systems else None
+        return self.rankings[(price_range, operating_system)]
+
+    def records(self, price_range, operating_system, count):
+        """Top count phones of the segment, read from the catalog the ranking was built from"""
+        return [self.catalog.record(idx) for idx in self.lookup(price_range, operating_system)[:count]]
@@ -0,0 +1,381 @@
+import contextlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+import uuid
+import numpy as np
+from mobile_catalog import load_catalog, SPEC_COLUMNS
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FORMAT_VERSION = 3
+CATEGORICAL_FEATURES = ['price_range', 'operating_system', 'processor_type', 'network_type']
+NUMERIC_FEATURES = ['ram', 'storage', 'camera_mp', 'battery_mah', 'screen_size']
+FEATURE_COLUMNS = ['price_range', 'ram', 'storage', 'camera_mp', 'battery_mah',
+                   'screen_size', 'operating_system', 'processor_type', 'network_type']
+NUMERIC_INDEX = [FEATURE_COLUMNS.index(f) for f in NUMERIC_FEATURES]
+CATEGORICAL_INDEX = [FEATURE_COLUMNS.index(f) for f in CATEGORICAL_FEATURES]
+
+DEFAULT_FEATURE_WEIGHTS = {
+    'price_range': 0.25,
+    'ram': 0.20,
+    'storage': 0.15,
+    'camera_mp': 0.15,
+    'battery_mah': 0.10,
+    'screen_size': 0.05,
+    'operating_system': 0.05,
+    'processor_type': 0.03,
+    'network_type': 0.02
+}
+
+KERNELS = ('cosine', 'euclidean', 'gower')
+STORE_ARRAYS = ['encoded', 'brands', 'embedding', 'embedding_norms', 'gower']
+
+
+def feature_store_path(db_path):
+    return os.path.splitext(db_path)[0] + '_features'
+
+
+@contextlib.contextmanager
+def build_lock(store_dir):
+    """Exclusive lock, across processes, for writing builds into store_dir and moving its CURRENT pointer"""
+    os.makedirs(store_dir, exist_ok=True)
+    with open(os.path.join(store_dir, 'LOCK'), 'a') as f:
+        # Without fcntl (Windows) builds are not serialized, but publish_build
+        # still keeps the build a concurrent reader may be opening.
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def publish_build(store_dir, build_name):
+    """Point CURRENT at build_name and remove every build older than the one it replaces; hold build_lock"""
+    current = os.path.join(store_dir, 'CURRENT')
+    try:
+        with open(current) as f:
+            previous = f.read().strip()
+    except OSError:
+        previous = None
+    pointer = os.path.join(store_dir, f'CURRENT.{build_name}')
+    with open(pointer, 'w') as f:
+        f.write(build_name)
+    os.replace(pointer, current)
+
+    # A reader may have just read the old pointer, so the build it names
+    # stays until the next swap. Processes that still have an older build
+    # mapped keep its pages alive until they unmap it.
+    for name in os.listdir(store_dir):
+        old_dir = os.path.join(store_dir, name)
+        if name not in (build_name, previous) and os.path.isdir(old_dir):
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def normalized_weights(feature_weights):
+    weights = np.array([feature_weights[f] for f in FEATURE_COLUMNS], dtype=np.float64)
+    if not np.all(weights >= 0) or weights.sum() <= 0:
+        raise ValueError(f"Feature weights must be non-negative with a positive sum, got {feature_weights}")
+    return weights / weights.sum()
+
+
+class FeatureStore:
+    """Encoded catalog features and kernel matrices, memory-mapped from disk.
+
+    ``encoded`` holds the label-encoded catalog matrix (categoricals as codes,
+    numerics as-is) used by the expert rules, and ``brands`` each row's index
+    into ``meta['brand_vocabulary']``. The similarity kernels work on a
+    mixed-type encoding with the feature weights folded in at build time:
+    ``embedding`` is standardized numerics scaled by sqrt(weight) followed by
+    one-hot categoricals scaled by sqrt(weight / 2), and ``gower`` is the raw
+    numerics scaled by weight / range. All arrays are opened with
+    ``mmap_mode='r'`` so every process reading the same build shares its
+    pages through the OS page cache.
+    """
+
+    def __init__(self, path, meta, arrays):
+        self.path = path
+        self.meta = meta
+        self.encoded = arrays['encoded']
+        self.brands = arrays['brands']
+        self.embedding = arrays['embedding']
+        self.embedding_norms = arrays['embedding_norms']
+        self.gower = arrays['gower']
+        self.vocabularies = {col: {value: code for code, value in enumerate(vocab)}
+                             for col, vocab in meta['vocabularies'].items()}
+        self.weights = normalized_weights(meta['feature_weights'])
+        self.mean = np.array(meta['numeric_mean'])
+        self.scale = np.array(meta['numeric_scale'])
+        self.ranges = np.array(meta['numeric_range'])
+        self.category_offsets = meta['category_offsets']
+
+    @property
+    def signature(self):
+        return tuple(self.meta['catalog_signature'])
+
+    def __len__(self):
+        return len(self.encoded)
+
+    @classmethod
+    def load(cls, store_dir, mmap_mode='r', build_name=None):
+        if build_name is None:
+            with open(os.path.join(store_dir, 'CURRENT')) as f:
+                build_name = f.read().strip()
+        build_dir = os.path.join(store_dir, build_name)
+        with open(os.path.join(build_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        if meta['format_version'] != FORMAT_VERSION:
+            raise ValueError(f"Feature store format {meta['format_version']} is not {FORMAT_VERSION}")
+        arrays = {name: np.load(os.path.join(build_dir, f'{name}.npy'), mmap_mode=mmap_mode)
+                  for name in STORE_ARRAYS}
+        return cls(build_dir, meta, arrays)
+
+    @classmethod
+    def load_build(cls, build_dir, mmap_mode='r'):
+        return cls.load(os.path.dirname(build_dir), mmap_mode, os.path.basename(build_dir))
+
+    def encode_preferences(self, user_preferences):
+        """Label-encode a preference dict; returns the vector and the columns it had no code for"""
+        encoded = np.zeros(len(FEATURE_COLUMNS))
+        unknown = []
+        for j, feature in enumerate(FEATURE_COLUMNS):
+            if feature in CATEGORICAL_FEATURES:
+                code = self.vocabularies[feature].get(str(user_preferences[feature]))
+                if code is None:
+                    unknown.append(j)
+                else:
+                    encoded[j] = code
+            else:
+                encoded[j] = float(user_preferences[feature])
+        return encoded, unknown
+
+    def kernel_query(self, user_preferences, weights=None):
+        """Query-side vectors for similarity(); weights override the built-in ones per feature"""
+        encoded, unknown = self.encode_preferences(user_preferences)
+        codes = encoded[CATEGORICAL_INDEX]
+        codes[[CATEGORICAL_INDEX.index(j) for j in unknown]] = -1
+        weights = self.weights if weights is None else weights
+        query = self.kernel_queries(encoded[None, NUMERIC_INDEX], codes[None, :], np.asarray(weights)[None, :])
+        query = {key: value[0] for key, value in query.items()}
+        query['embedding_norm'] = float(query['embedding_norm'][0])
+        query['categorical_weight'] = float(query['categorical_weight'][0])
+        return query
+
+    def kernel_queries(self, numerics, codes, weights):
+        """Query-side vectors for many profiles: raw numerics, category codes (-1 if unknown) and weights"""
+        weights = np.asarray(weights, dtype=np.float64)
+        if np.any(weights < 0):
+            raise ValueError("Feature weights must be non-negative")
+        # The catalog matrices already carry the build's weights, so other
+        # weights (e.g. learned per segment) are applied as a ratio on the query
+        # side only and never touch the catalog. A feature built with weight 0
+        # has nothing in the catalog matrices and cannot be scored at all.
+        built = self.weights > 0
+        weights = np.where(built, weights, 0.0)
+        totals = weights.sum(axis=1, keepdims=True)
+        weights = np.divide(weights, totals, out=np.tile(self.weights, (len(weights), 1)), where=totals > 0)
+        ratio = np.divide(weights, self.weights, out=np.zeros(weights.shape), where=built)
+        standardized = (numerics - self.mean) / self.scale
+        numeric_embedding = np.sqrt(self.weights[NUMERIC_INDEX]) * standardized
+        embedding = np.zeros((len(numerics), self.embedding.shape[1]))
+        embedding[:, :len(NUMERIC_INDEX)] = numeric_embedding * ratio[:, NUMERIC_INDEX]
+        profiles = np.arange(len(numerics))
+        for k, (feature, j) in enumerate(zip(CATEGORICAL_FEATURES, CATEGORICAL_INDEX)):
+            known = codes[:, k] >= 0
+            columns = self.category_offsets[feature] + codes[known, k].astype(np.int64)
+            embedding[profiles[known], columns] = np.sqrt(self.weights[j] / 2) * ratio[known, j]
+        norm_squared = (weights[:, NUMERIC_INDEX] * standardized ** 2).sum(axis=1)
+        norm_squared += (weights[:, CATEGORICAL_INDEX] * (codes >= 0)).sum(axis=1) / 2
+        return {
+            'embedding': embedding,
+            'embedding_norm': np.sqrt(norm_squared)[:, None],
+            'numeric_embedding': numeric_embedding,
+            'numeric_ratio': ratio[:, NUMERIC_INDEX],
+            'gower': numerics * self.weights[NUMERIC_INDEX] / self.ranges,
+            'categorical_weight': weights[:, CATEGORICAL_INDEX].sum(axis=1)[:, None]
+        }
+
+    def similarity(self, query, kernel='cosine', rows=slice(None)):
+        """Kernel similarity between one kernel_query() and each catalog row"""
+        return self._similarity(query, kernel, self.embedding[rows], self.embedding_norms[rows],
+                                self.gower[rows], batch=False)
+
+    def batch_similarity(self, queries, kernel='cosine', rows=slice(None)):
+        """Kernel similarity between kernel_queries() and each catalog row, as a (profiles, rows) matrix"""
+        return self._similarity(queries, kernel, self.embedding[rows], self.embedding_norms[rows],
+                                self.gower[rows], batch=True)
+
+    def _similarity(self, query, kernel, embedding, embedding_norms, gower, batch):
+        if kernel not in KERNELS:
+            raise ValueError(f"Unknown similarity kernel {kernel!r}, expected one of {KERNELS}")
+
+        def dot(start):
+            if batch:
+                return query['embedding'][:, start:] @ embedding[:, start:].T
+            # einsum reduces each row on its own, so a row scores the same
+            # however the catalog is sliced into shards.
+            return np.einsum('nd,d->n', embedding[:, start:], query['embedding'][start:])
+
+        if kernel == 'cosine':
+            dots = dot(0)
+            denominator = embedding_norms * query['embedding_norm']
+            return np.divide(dots, denominator, out=np.zeros(dots.shape), where=denominator > 0)
+
+        # A matching category adds weight / 2 to the one-hot dot product, so
+        # the weighted categorical mismatch is what is left of the total.
+        distance = query['categorical_weight'] - 2 * dot(len(NUMERIC_INDEX))
+        for k, j in enumerate(NUMERIC_INDEX):
+            ratio = query['numeric_ratio'][..., k, None]
+            if kernel == 'euclidean':
+                diff = embedding[:, k] - query['numeric_embedding'][..., k, None]
+                distance = distance + ratio * diff * diff
+            else:
+                diff = np.minimum(np.abs(gower[:, k] - query['gower'][..., k, None]), self.weights[j])
+                distance = distance + ratio * diff
+        if kernel == 'euclidean':
+            return 1.0 / (1.0 + np.sqrt(np.maximum(distance, 0)))
+        return 1.0 - distance
+
+    def pair_similarity(self, query, mobile_specs, kernel='cosine'):
+        """Kernel similarity between a kernel_query() and one spec dict that need not be in the catalog"""
+        side = self.kernel_query(mobile_specs)
+        embedding = side['embedding'][None, :].astype(np.float32)
+        norms = np.sqrt(np.einsum('nd,nd->n', embedding, embedding, dtype=np.float64))
+        return float(self._similarity(query, kernel, embedding, norms, side['gower'][None, :], batch=False)[0])
+
+
+def _read_user_choices(db_path):
+    import pandas as pd
+    conn = sqlite3.connect(db_path)
+    user_choices = pd.read_sql_query("SELECT * FROM user_choices", conn)
+    conn.close()
+    return user_choices
+
+
+def build_feature_store(db_path='mobile_recommendations.db', catalog=None, user_choices=None,
+                        feature_weights=None):
+    """Encode the catalog, fold in the feature weights and write a new feature store build"""
+    with build_lock(feature_store_path(db_path)):
+        return _write_build(db_path, catalog, user_choices, feature_weights)
+
+
+def _write_build(db_path, catalog, user_choices, feature_weights):
+    # Only building needs pandas and sklearn; serving reads the saved arrays.
+    import pandas as pd
+    from sklearn.preprocessing import LabelEncoder, StandardScaler
+    catalog = catalog if catalog is not None else load_catalog(db_path)
+    user_choices = user_choices if user_choices is not None else _read_user_choices(db_path)
+    feature_weights = dict(feature_weights or DEFAULT_FEATURE_WEIGHTS)
+    weights = normalized_weights(feature_weights)
+    store_dir = feature_store_path(db_path)
+
+    all_data = pd.DataFrame({
+        col: np.concatenate([catalog.column(col), user_choices[col].to_numpy()])
+        for col in SPEC_COLUMNS
+    })
+    vocabularies = {}
+    for col in CATEGORICAL_FEATURES:
+        le = LabelEncoder()
+        all_data[col] = le.fit_transform(all_data[col].astype(str))
+        vocabularies[col] = [str(value) for value in le.classes_]
+
+    all_encoded = all_data[FEATURE_COLUMNS].to_numpy(dtype=np.float64)
+    encoded = np.ascontiguousarray(all_encoded[:len(catalog)])
+    all_numerics = all_encoded[:, NUMERIC_INDEX]
+    scaler = StandardScaler()
+    scaler.fit(all_numerics)
+    ranges = all_numerics.max(axis=0) - all_numerics.min(axis=0) if len(all_numerics) else np.ones(len(NUMERIC_INDEX))
+    ranges[ranges == 0] = 1.0
+
+    numerics = encoded[:, NUMERIC_INDEX]
+    blocks = [np.sqrt(weights[NUMERIC_INDEX]) * scaler.transform(numerics)]
+    category_offsets = {}
+    offset = len(NUMERIC_INDEX)
+    for col, j in zip(CATEGORICAL_FEATURES, CATEGORICAL_INDEX):
+        one_hot = np.zeros((len(catalog), len(vocabularies[col])))
+        one_hot[np.arange(len(catalog)), encoded[:, j].astype(np.int64)] = np.sqrt(weights[j] / 2)
+        blocks.append(one_hot)
+        category_offsets[col] = offset
+        offset += len(vocabularies[col])
+    embedding = np.hstack(blocks).astype(np.float32)
+
+    arrays = {
+        'encoded': encoded,
+        'brands': catalog.codes['brand'],
+        'embedding': embedding,
+        'embedding_norms': np.sqrt(np.einsum('nd,nd->n', embedding, embedding, dtype=np.float64)),
+        'gower': (numerics * weights[NUMERIC_INDEX] / ranges).astype(np.float32)
+    }
+
+    build_name = f"v{FORMAT_VERSION}-{uuid.uuid4().hex[:12]}"
+    build_dir = os.path.join(store_dir, build_name)
+    os.makedirs(build_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(build_dir, f'{name}.npy'), array)
+    with open(os.path.join(build_dir, 'meta.json'), 'w') as f:
+        json.dump({
+            'format_version': FORMAT_VERSION,
+            'catalog_signature': list(catalog.signature),
+            'feature_columns': FEATURE_COLUMNS,
+            'feature_weights': feature_weights,
+            'vocabularies': vocabularies,
+            'brand_vocabulary': [str(brand) for brand in catalog.vocabularies['brand']],
+            'numeric_mean': scaler.mean_.tolist(),
+            'numeric_scale': scaler.scale_.tolist(),
+            'numeric_range': ranges.tolist(),
+            'category_offsets': category_offsets,
+            'num_rows': len(catalog),
+            'built_at': time.time()
+        }, f)
+
+    publish_build(store_dir, build_name)
+    return FeatureStore.load(store_dir, build_name=build_name)
+
+
+_stores = {}
+
+
+def load_feature_store(db_path='mobile_recommendations.db', catalog=None, user_choices=None,
+                       feature_weights=None):
+    """Feature store matching the current catalog and weights, building it first if it is missing or stale"""
+    catalog = catalog if catalog is not None else load_catalog(db_path)
+    feature_weights = dict(feature_weights or DEFAULT_FEATURE_WEIGHTS)
+
+    def is_current(store):
+        return (store is not None and store.signature == catalog.signature
+                and store.meta['feature_weights'] == feature_weights)
+
+    def load():
+        try:
+            return FeatureStore.load(store_dir)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    store_dir = feature_store_path(db_path)
+    store = _stores.get(db_path)
+    if not is_current(store):
+        store = load()
+        if not is_current(store):
+            # Other workers may notice the same change; the first one to get
+            # the lock builds and the rest load its build.
+            with build_lock(store_dir):
+                store = load()
+                if not is_current(store):
+                    try:
+                        store = _write_build(db_path, catalog, user_choices, feature_weights)
+                    except OSError:
+                        store = load()
+                        if not is_current(store):
+                            raise
+        _stores[db_path] = store
+    return store
+
+
+if __name__ == "__main__":
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'mobile_recommendations.db'
+    start = time.time()
+    store = build_feature_store(db_path)
+    print(f"Built feature store for {len(store)} phones in {time.time() - start:.2f}s: {store.path}")
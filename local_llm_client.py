@@ -1,17 +1,31 @@
-import requests
 import sqlite3
-import pandas as pd
-import json
-import time
+import threading
+from mobile_catalog import load_catalog
+from catalog_changes import watch_catalog
+from single_flight import single_flight, canonical_key
+from tracing import span, timed, profile
 
 class RemoteLLMRecommender:
     def __init__(self, colab_url, db_path='mobile_recommendations.db'):
         self.colab_url = colab_url.rstrip('/')
         self.db_path = db_path
         self.timeout = 60
+        self.prompt_cache = None
+        self.fallback = None
+        self.fallback_expert_system = None
+        self.fallback_lock = threading.Lock()
+        self.fallback_refresh_lock = threading.Lock()
+        # Shared by every client of this service in the process, so identical
+        # requests from concurrent sessions make a single upstream call.
+        self.single_flight = single_flight(self.colab_url)
+        watch_catalog(db_path).subscribe(self.on_catalog_change)
         self.test_connection()
+        # The fallback is there for LLM outages, so it is ready before the
+        # first request rather than built during one.
+        self.refresh_fallback()
     
     def test_connection(self):
+        import requests
         try:
             response = requests.get(f"{self.colab_url}/health", timeout=10)
             if response.status_code == 200:
@@ -29,14 +43,47 @@ class RemoteLLMRecommender:
             return False
     
     def load_mobile_data(self):
-        conn = sqlite3.connect(self.db_path)
-        df = pd.read_sql_query("SELECT * FROM mobile_data", conn)
-        conn.close()
-        return df
+        return load_catalog(self.db_path)
+    
+    def close(self):
+        """Stop following catalog changes, so the watcher no longer keeps this client alive"""
+        watch_catalog(self.db_path).unsubscribe(self.on_catalog_change)
+        with self.fallback_lock:
+            if self.fallback_expert_system is not None:
+                self.fallback_expert_system.close()
+                self.fallback_expert_system = None
+            self.fallback = None
     
-    def format_mobile_database_for_llm(self, mobile_data):
+    def on_catalog_change(self, previous_version, version, changes):
+        # Any change shows up in the prompt listing, so drop it outright.
+        self.prompt_cache = None
+        self.refresh_fallback()
+    
+    def refresh_fallback(self):
+        """Bring the fallback ranking up to date with the catalog on a background thread"""
+        # One refresh runs at a time, and it keeps rebuilding until the
+        # ranking matches the latest catalog, so changes made during a build
+        # are picked up as well.
+        if not self.fallback_refresh_lock.acquire(blocking=False):
+            return
+        def refresh():
+            try:
+                while True:
+                    fallback = self.fallback
+                    if fallback is not None and fallback.signature == self.load_mobile_data().signature:
+                        break
+                    with self.fallback_lock:
+                        self.fallback = self.build_fallback()
+            except Exception as e:
+                print(f"Could not build the fallback ranking: {e}")
+            finally:
+                self.fallback_refresh_lock.release()
+        threading.Thread(target=refresh, daemon=True).start()
+    
+    @staticmethod
+    def format_mobile_database_for_llm(mobile_data):
         mobile_db_text = ""
-        for i, mobile in mobile_data.iterrows():
+        for i, mobile in enumerate(mobile_data):
             mobile_db_text += f"{i+1}. {mobile['brand']} {mobile['model']} - "
             mobile_db_text += f"Price: {mobile['price_range']}, "
             mobile_db_text += f"RAM: {mobile['ram']}GB, "
@@ -49,22 +96,53 @@ class RemoteLLMRecommender:
             mobile_db_text += f"Network: {mobile['network_type']}\n"
         return mobile_db_text
     
-    def get_llm_recommendations(self, user_preferences, num_recommendations=2):
-        mobile_data = self.load_mobile_data()
-        mobile_db_text = self.format_mobile_database_for_llm(mobile_data)
+    @profile('llm_recommendations')
+    @timed('llm.recommend')
+    def get_llm_recommendations(self, user_preferences, num_recommendations=2, generation_mode=None,
+                                max_new_tokens=None):
+        with span('llm.load_catalog'):
+            mobile_data = self.load_mobile_data()
+        with span('llm.format_prompt'):
+            # Keyed by signature: a thread that formatted the previous catalog
+            # can store its text after on_catalog_change cleared the cache.
+            cached = self.prompt_cache
+            if cached is not None and cached[0] == mobile_data.signature:
+                mobile_db_text = cached[1]
+            else:
+                mobile_db_text = self.format_mobile_database_for_llm(mobile_data)
+                self.prompt_cache = (mobile_data.signature, mobile_db_text)
         request_data = {
             'user_preferences': user_preferences,
             'mobile_database': mobile_db_text,
             'num_recommendations': num_recommendations
         }
+        if generation_mode is not None:
+            request_data['generation_mode'] = generation_mode
+        if max_new_tokens is not None:
+            request_data['max_new_tokens'] = max_new_tokens
+        key = canonical_key(user_preferences, num_recommendations, generation_mode, max_new_tokens,
+                            self.db_path, mobile_data.signature)
+        recommendations, shared = self.single_flight.do(
+            key, self.request_llm_recommendations, request_data, user_preferences, mobile_data, num_recommendations
+        )
+        if not shared:
+            return recommendations
+        print("Shared the result of an identical in-flight LLM request")
+        # Each caller gets its own records, since callers attach extras to them.
+        return [rec.catalog.record(rec.index, dict(rec.extra) if rec.extra is not None else None)
+                for rec in recommendations]
+    
+    def request_llm_recommendations(self, request_data, user_preferences, mobile_data, num_recommendations):
+        import requests
         try:
             print("Requesting recommendations from Colab LLM...")
-            response = requests.post(
-                f"{self.colab_url}/recommend",
-                json=request_data,
-                timeout=self.timeout,
-                headers={'Content-Type': 'application/json'}
-            )
+            with span('llm.http_roundtrip', url=self.colab_url):
+                response = requests.post(
+                    f"{self.colab_url}/recommend",
+                    json=request_data,
+                    timeout=self.timeout,
+                    headers={'Content-Type': 'application/json'}
+                )
             if response.status_code == 200:
                 result = response.json()
                 if result.get('success', False):
@@ -91,16 +169,20 @@ class RemoteLLMRecommender:
             print(f"Unexpected error: {e}")
             return self.get_fallback_recommendations(user_preferences, mobile_data, num_recommendations)
     
+    def coalescing_stats(self):
+        return self.single_flight.stats()
+    
+    @timed('llm.match')
     def match_recommendations_to_database(self, recommendations, reasoning, mobile_data):
         matched_recommendations = []
         for rec_text in recommendations:
             matched_mobile = self.find_mobile_in_database(rec_text, mobile_data)
             if matched_mobile is not None:
-                mobile_info = mobile_data.iloc[matched_mobile].to_dict()
-                mobile_info['llm_reasoning'] = reasoning
-                mobile_info['recommendation_text'] = rec_text
-                mobile_info['source'] = 'LLM'
-                matched_recommendations.append(mobile_info)
+                matched_recommendations.append(mobile_data.record(matched_mobile, {
+                    'llm_reasoning': reasoning,
+                    'recommendation_text': rec_text,
+                    'source': 'LLM'
+                }))
             else:
                 print(f"Could not match recommendation: {rec_text}")
         return matched_recommendations
@@ -109,10 +191,13 @@ class RemoteLLMRecommender:
         recommendation_lower = recommendation_text.lower()
         best_match_idx = None
         best_match_score = 0
-        for idx, mobile in mobile_data.iterrows():
-            mobile_text = f"{mobile['brand']} {mobile['model']}".lower()
-            brand_match = mobile['brand'].lower() in recommendation_lower
-            model_words = mobile['model'].lower().split()
+        brands = mobile_data.column('brand')
+        for idx in range(len(mobile_data)):
+            brand = brands[idx].lower()
+            model = mobile_data.model(idx).lower()
+            mobile_text = f"{brand} {model}"
+            brand_match = brand in recommendation_lower
+            model_words = model.split()
             model_match = any(word in recommendation_lower for word in model_words if len(word) > 2)
             if mobile_text in recommendation_lower:
                 return idx
@@ -126,23 +211,47 @@ class RemoteLLMRecommender:
                 best_match_idx = idx
         return best_match_idx if best_match_score > 0 else None
     
+    def fallback_ranking(self, mobile_data):
+        """Per-segment expert ranking, built here only if there is none yet"""
+        fallback = self.fallback
+        if fallback is None:
+            # A request that needs the ranking while refresh_fallback is
+            # building it waits for that build instead of starting a second one.
+            with self.fallback_lock:
+                if self.fallback is None:
+                    self.fallback = self.build_fallback()
+                fallback = self.fallback
+        elif fallback.signature != mobile_data.signature:
+            # The ranking reads its phones from its own catalog, so it stays
+            # usable while the background refresh catches up.
+            self.refresh_fallback()
+        return fallback
+    
+    def build_fallback(self):
+        # The expert system pulls in pandas and the feature store, so it is
+        # imported here rather than with this module.
+        from expert_system import MobileExpertSystem
+        from fallback_ranking import FallbackRanking
+        if self.fallback_expert_system is None:
+            self.fallback_expert_system = MobileExpertSystem(self.db_path)
+        with span('llm.fallback_build'):
+            return FallbackRanking.build(self.fallback_expert_system)
+    
+    @timed('llm.fallback')
     def get_fallback_recommendations(self, user_preferences, mobile_data, num_recommendations):
         print("Using fallback recommendations...")
-        filtered_mobiles = mobile_data[
-            (mobile_data['price_range'] == user_preferences['price_range']) |
-            (mobile_data['operating_system'] == user_preferences['operating_system'])
-        ]
-        if filtered_mobiles.empty:
-            filtered_mobiles = mobile_data
+        ranked = self.fallback_ranking(mobile_data).records(
+            user_preferences['price_range'], user_preferences['operating_system'], num_recommendations
+        )
         recommendations = []
-        for _, mobile in filtered_mobiles.head(num_recommendations).iterrows():
-            mobile_dict = mobile.to_dict()
-            mobile_dict['llm_reasoning'] = "Fallback recommendation due to LLM service unavailability. Based on basic preference matching."
-            mobile_dict['recommendation_text'] = f"{mobile['brand']} {mobile['model']}"
-            mobile_dict['source'] = 'Fallback'
-            recommendations.append(mobile_dict)
+        for mobile in ranked:
+            mobile['llm_reasoning'] = "Fallback recommendation due to LLM service unavailability. Ranked by the expert system for your price range and OS."
+            mobile['recommendation_text'] = f"{mobile['brand']} {mobile['model']}"
+            mobile['source'] = 'Fallback'
+            recommendations.append(mobile)
         return recommendations
     
+    @timed('llm.save_choice')
     def save_user_choice(self, user_preferences, chosen_mobile):
         choice_data = (
             user_preferences['price_range'],
@@ -201,4 +310,6 @@ if __name__ == "__main__":
             if 'llm_reasoning' in rec:
                 print(f"   Reasoning: {rec['llm_reasoning'][:100]}...")
             print()
-        print("Test completed successfully")
\ No newline at end of file
+        print("Test completed successfully")
+    except Exception as e:
+        print(f"Test failed: {e}")
@@ -0,0 +1,274 @@
+import json
+import os
+import threading
+import time
+from flask import Flask, request, jsonify
+from single_flight import SingleFlight, canonical_key, text_digest
+
+# CPU counterpart of the Colab service: a GGUF-quantized model served by
+# llama.cpp behind the same /health and /recommend contract, so
+# RemoteLLMRecommender can point DSS_LLM_URL at either one.
+# DSS_GGUF_MODEL takes a local .gguf file; otherwise the DSS_GGUF_QUANT file
+# of DSS_GGUF_REPO is downloaded from the Hugging Face hub.
+GGUF_MODEL = os.environ.get('DSS_GGUF_MODEL', '')
+GGUF_REPO = os.environ.get('DSS_GGUF_REPO', 'Qwen/Qwen2.5-3B-Instruct-GGUF')
+GGUF_QUANT = os.environ.get('DSS_GGUF_QUANT', 'q4_k_m')
+CONTEXT_TOKENS = int(os.environ.get('DSS_LLM_CONTEXT_TOKENS', '8192'))
+THREADS = int(os.environ.get('DSS_LLM_THREADS', '0'))
+GENERATION_MODES = ('standard', 'assisted', 'fast', 'auto')
+DEFAULT_MAX_NEW_TOKENS = int(os.environ.get('DSS_LLM_MAX_NEW_TOKENS', '768'))
+MAX_NEW_TOKENS_LIMIT = int(os.environ.get('DSS_LLM_MAX_NEW_TOKENS_LIMIT', '2048'))
+
+SYSTEM_TEMPLATE = """You are an expert mobile phone consultant with deep knowledge of smartphone specifications and user needs.
+
+Available Mobile Phones Database:
+{mobile_database}
+Your recommendations MUST be selected from the provided database only. Use the exact brand and model names as they appear in the database.
+
+Consider the following factors in your recommendation:
+1. How well each phone matches the user's specified requirements
+2. Value for money in the given price range
+3. Overall performance and user experience
+4. Brand reliability and build quality
+5. Future-proofing with latest features
+
+Respond ONLY with a JSON object with two fields: "recommendations", a list of the exact "Brand Model" names as they appear in the database, and "reasoning", a detailed explanation of why each recommended phone is suitable for this user."""
+
+USER_TEMPLATE = """User Requirements:
+- Price Range: {price_range}
+- RAM: {ram}GB minimum
+- Storage: {storage}GB minimum
+- Camera: {camera_mp}MP minimum
+- Battery: {battery_mah}mAh minimum
+- Screen Size: Around {screen_size} inches
+- Operating System: {operating_system}
+- Processor Type: {processor_type}
+- Network: {network_type}
+
+Recommend exactly {num_recommendations} mobile phones that best match these requirements."""
+
+
+def default_threads():
+    """(generation, prompt) thread counts: physical cores for decoding, every usable core for the prompt"""
+    usable = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    try:
+        import psutil
+        physical = psutil.cpu_count(logical=False) or usable
+    except ImportError:
+        physical = usable
+    # Token generation is memory bound and slows down once hyperthreads
+    # share a core, while the batched prompt pass uses them well.
+    return max(1, min(physical, usable)), usable
+
+
+class QuantizedLLMService:
+    """Recommendations from a quantized GGUF model on the CPU via llama.cpp.
+
+    The catalog goes in the system message ahead of the user's requirements,
+    so consecutive requests share the catalog prefix and llama.cpp only
+    evaluates the requirements. A JSON schema grammar keeps the answer to
+    exactly num_recommendations names, and generation ends with the object.
+    """
+
+    def __init__(self, model_path=GGUF_MODEL, repo_id=GGUF_REPO, quant=GGUF_QUANT,
+                 context_tokens=CONTEXT_TOKENS, threads=THREADS):
+        from llama_cpp import Llama
+        generation_threads, prompt_threads = default_threads()
+        if threads:
+            generation_threads = prompt_threads = threads
+        options = dict(n_ctx=context_tokens, n_threads=generation_threads, n_threads_batch=prompt_threads,
+                       n_gpu_layers=0, verbose=False)
+        print(f"Loading quantized LLM ({generation_threads} generation / {prompt_threads} prompt threads)...")
+        if model_path:
+            self.model = Llama(model_path=model_path, **options)
+            self.model_name = os.path.basename(model_path)
+        else:
+            self.model = Llama.from_pretrained(repo_id=repo_id, filename=f"*{quant}.gguf", **options)
+            self.model_name = f"{repo_id}:{quant}"
+        print("Quantized LLM loaded successfully!")
+        self.threads = generation_threads
+        self.prompt_threads = prompt_threads
+        # llama.cpp keeps one KV cache, so requests take turns.
+        self.lock = threading.Lock()
+
+    def response_format(self, num_recommendations):
+        return {
+            'type': 'json_object',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'recommendations': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                        'minItems': num_recommendations,
+                        'maxItems': num_recommendations
+                    },
+                    'reasoning': {'type': 'string'}
+                },
+                'required': ['recommendations', 'reasoning']
+            }
+        }
+
+    def get_recommendations(self, user_preferences, mobile_database, num_recommendations=2,
+                            max_new_tokens=None):
+        max_new_tokens = max_new_tokens or DEFAULT_MAX_NEW_TOKENS
+        messages = [
+            {'role': 'system', 'content': SYSTEM_TEMPLATE.format(mobile_database=mobile_database)},
+            {'role': 'user', 'content': USER_TEMPLATE.format(num_recommendations=num_recommendations,
+                                                             **user_preferences)}
+        ]
+        try:
+            with self.lock:
+                start = time.perf_counter()
+                completion = self.model.create_chat_completion(
+                    messages,
+                    max_tokens=max_new_tokens,
+                    temperature=0.7,
+                    response_format=self.response_format(num_recommendations)
+                )
+                elapsed = time.perf_counter() - start
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e),
+                'recommendations': [],
+                'reasoning': f"Error generating recommendations: {str(e)}"
+            }
+
+        choice = completion['choices'][0]
+        response = choice['message']['content']
+        new_tokens = completion['usage']['completion_tokens']
+        generation = {
+            'mode': 'standard',
+            'model': self.model_name,
+            'backend': 'llama.cpp',
+            'threads': self.threads,
+            'max_new_tokens': max_new_tokens,
+            'prompt_tokens': completion['usage']['prompt_tokens'],
+            'new_tokens': new_tokens,
+            'stop_reason': 'budget' if choice['finish_reason'] == 'length' else 'json_complete',
+            'seconds': round(elapsed, 3),
+            'ms_per_token': round(elapsed * 1000 / max(new_tokens, 1), 2)
+        }
+        try:
+            output_dict = json.loads(response, strict=False)
+        except json.JSONDecodeError as e:
+            error = str(e)
+            if generation['stop_reason'] == 'budget':
+                error = f"Token budget of {max_new_tokens} ran out before the JSON answer was complete"
+            return {
+                'success': False,
+                'error': error,
+                'recommendations': [],
+                'reasoning': f"Error generating recommendations: {error}",
+                'raw_response': response,
+                'generation': generation
+            }
+        return {
+            'success': True,
+            'recommendations': output_dict.get('recommendations', []),
+            'reasoning': output_dict.get('reasoning', "No reasoning provided"),
+            'raw_response': response,
+            'generation': generation
+        }
+
+
+def invalid_request(error):
+    return jsonify({
+        'success': False,
+        'error': error,
+        'recommendations': [],
+        'reasoning': "Invalid request"
+    }), 400
+
+
+app = Flask(__name__)
+llm_service = None
+# Under flask run or gunicorn nothing preloads the model, so concurrent first
+# requests would otherwise each load their own copy.
+llm_service_lock = threading.Lock()
+# Identical requests that arrive while one is generating wait for its answer
+# rather than queueing for the model lock behind it.
+recommend_flight = SingleFlight()
+
+
+def get_service():
+    global llm_service
+    if llm_service is None:
+        with llm_service_lock:
+            if llm_service is None:
+                llm_service = QuantizedLLMService()
+    return llm_service
+
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    service = get_service()
+    return jsonify({
+        "status": "healthy",
+        "model_loaded": True,
+        "model": service.model_name,
+        "draft_model": None,
+        "backend": "llama.cpp",
+        "threads": service.threads,
+        "prompt_threads": service.prompt_threads,
+        "generation_modes": GENERATION_MODES,
+        "default_generation_mode": 'standard',
+        "default_max_new_tokens": DEFAULT_MAX_NEW_TOKENS,
+        "max_new_tokens_limit": MAX_NEW_TOKENS_LIMIT,
+        "coalescing": recommend_flight.stats()
+    })
+
+
+@app.route('/recommend', methods=['POST'])
+def recommend():
+    try:
+        data = request.json
+        user_preferences = data['user_preferences']
+        mobile_database = data['mobile_database']
+        num_recommendations = data.get('num_recommendations', 2)
+        # There is a single quantized model, so every mode is served by it.
+        generation_mode = data.get('generation_mode')
+        if generation_mode is not None and generation_mode not in GENERATION_MODES:
+            return invalid_request(
+                f"Unknown generation_mode {generation_mode!r}, expected one of {list(GENERATION_MODES)}"
+            )
+        max_new_tokens = data.get('max_new_tokens')
+        if max_new_tokens is not None and (
+                isinstance(max_new_tokens, bool) or not isinstance(max_new_tokens, int)
+                or not 1 <= max_new_tokens <= MAX_NEW_TOKENS_LIMIT):
+            return invalid_request(f"max_new_tokens must be an integer between 1 and {MAX_NEW_TOKENS_LIMIT}")
+
+        print(f"Recommendation request: {num_recommendations} phones from "
+              f"{len(mobile_database.splitlines())} entries")
+        # generation_mode is left out of the key: every mode runs the same model.
+        key = canonical_key(user_preferences, num_recommendations, max_new_tokens, text_digest(mobile_database))
+        result, shared = recommend_flight.do(
+            key, get_service().get_recommendations,
+            user_preferences, mobile_database, num_recommendations, max_new_tokens
+        )
+        if shared:
+            print("Shared the answer of an identical in-flight request")
+            return jsonify(dict(result, coalesced=True))
+        if result['success']:
+            generation = result['generation']
+            print(f"Generated {generation['new_tokens']} tokens in {generation['seconds']}s "
+                  f"({generation['ms_per_token']} ms/token)")
+        else:
+            print(f"Request failed: {result.get('error', 'Unknown error')}")
+        return jsonify(result)
+
+    except Exception as e:
+        print(f"Flask route error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e),
+            'recommendations': [],
+            'reasoning': f"Service error: {str(e)}"
+        }), 500
+
+
+if __name__ == "__main__":
+    get_service()
+    app.run(host=os.environ.get('DSS_HOST', '0.0.0.0'), port=int(os.environ.get('DSS_LLM_PORT', '5000')),
+            threaded=True)
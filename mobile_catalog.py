@@ -0,0 +1,217 @@
+import sqlite3
+import threading
+import numpy as np
+from catalog_changes import watch_catalog
+
+CATEGORICAL_COLUMNS = ['brand', 'price_range', 'operating_system', 'processor_type', 'network_type']
+INTEGER_COLUMNS = ['ram', 'storage', 'camera_mp', 'battery_mah']
+SPEC_COLUMNS = ['price_range', 'ram', 'storage', 'camera_mp', 'battery_mah',
+                'screen_size', 'operating_system', 'processor_type', 'network_type']
+RECORD_COLUMNS = ['id', 'brand', 'model'] + SPEC_COLUMNS
+
+# Screen sizes are stored in hundredths of an inch so they fit a uint16 and
+# decode back to exactly the same float the database holds.
+SCREEN_SIZE_SCALE = 100
+
+
+def _narrow_uint(max_value):
+    return np.min_scalar_type(max(int(max_value), 0))
+
+
+class MobileRecord:
+    """Read-only view of one catalog row, with optional per-request extras"""
+    __slots__ = ('catalog', 'index', 'extra')
+
+    def __init__(self, catalog, index, extra=None):
+        self.catalog = catalog
+        self.index = index
+        self.extra = extra
+
+    def __getitem__(self, key):
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        return self.catalog.value(key, self.index)
+
+    def __setitem__(self, key, value):
+        if self.extra is None:
+            self.extra = {}
+        self.extra[key] = value
+
+    def __contains__(self, key):
+        return key in self.catalog.columns or (self.extra is not None and key in self.extra)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = list(RECORD_COLUMNS)
+        if self.extra is not None:
+            keys.extend(k for k in self.extra if k not in self.catalog.columns)
+        return keys
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"MobileRecord({self['brand']} {self['model']})"
+
+
+class MobileCatalog:
+    """Columnar, dictionary-encoded copy of the mobile_data table.
+
+    Categorical columns are stored as narrow integer codes into a per-column
+    vocabulary, numeric columns as the narrowest dtype that holds them, and
+    model names as a single UTF-8 blob with offsets. Instances are treated as
+    immutable and shared between the expert system and the LLM client.
+    """
+
+    def __init__(self, ids, codes, vocabularies, numerics, model_blob, model_offsets, signature=None):
+        self.ids = ids
+        self.codes = codes
+        self.vocabularies = vocabularies
+        self.numerics = numerics
+        self.model_blob = model_blob
+        self.model_offsets = model_offsets
+        self.signature = signature
+        self.columns = frozenset(RECORD_COLUMNS)
+        self._model_index = None
+        for array in [ids, model_offsets, *codes.values(), *numerics.values()]:
+            array.setflags(write=False)
+
+    @classmethod
+    def from_rows(cls, rows, signature=None):
+        rows = list(rows)
+        vocabularies = {}
+        codes = {}
+        for col in CATEGORICAL_COLUMNS:
+            offset = RECORD_COLUMNS.index(col)
+            values = [row[offset] for row in rows]
+            vocab, inverse = np.unique(np.array(values, dtype=object).astype(str), return_inverse=True)
+            vocabularies[col] = vocab.astype(object)
+            codes[col] = inverse.astype(_narrow_uint(max(len(vocab) - 1, 0)))
+
+        numerics = {}
+        for col in INTEGER_COLUMNS:
+            offset = RECORD_COLUMNS.index(col)
+            values = np.array([row[offset] for row in rows], dtype=np.int64)
+            numerics[col] = values.astype(_narrow_uint(values.max() if len(values) else 0))
+        offset = RECORD_COLUMNS.index('screen_size')
+        screen = np.rint(np.array([row[offset] for row in rows], dtype=np.float64) * SCREEN_SIZE_SCALE)
+        numerics['screen_size'] = screen.astype(_narrow_uint(screen.max() if len(screen) else 0))
+
+        encoded_models = [str(row[2]).encode('utf-8') for row in rows]
+        model_offsets = np.zeros(len(rows) + 1, dtype=np.uint32)
+        np.cumsum([len(m) for m in encoded_models], out=model_offsets[1:])
+        ids = np.array([row[0] for row in rows], dtype=np.uint32)
+        return cls(ids, codes, vocabularies, numerics, b''.join(encoded_models), model_offsets, signature)
+
+    @classmethod
+    def from_db(cls, db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            signature = catalog_signature(conn)
+            rows = conn.execute(f"SELECT {', '.join(RECORD_COLUMNS)} FROM mobile_data ORDER BY id").fetchall()
+        finally:
+            conn.close()
+        return cls.from_rows(rows, signature)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield MobileRecord(self, index)
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    @property
+    def nbytes(self):
+        total = self.ids.nbytes + self.model_offsets.nbytes + len(self.model_blob)
+        total += sum(a.nbytes for a in self.codes.values()) + sum(a.nbytes for a in self.numerics.values())
+        total += sum(sum(len(v) for v in vocab) for vocab in self.vocabularies.values())
+        return total
+
+    def record(self, index, extra=None):
+        return MobileRecord(self, int(index), extra)
+
+    def model(self, index):
+        start, end = self.model_offsets[index], self.model_offsets[index + 1]
+        return self.model_blob[start:end].decode('utf-8')
+
+    def value(self, column, index):
+        if column in self.codes:
+            return self.vocabularies[column][self.codes[column][index]]
+        if column == 'screen_size':
+            return int(self.numerics[column][index]) / SCREEN_SIZE_SCALE
+        if column in self.numerics:
+            return int(self.numerics[column][index])
+        if column == 'model':
+            return self.model(index)
+        if column == 'id':
+            return int(self.ids[index])
+        raise KeyError(column)
+
+    def column(self, column):
+        """Decoded column as a NumPy array (object dtype for strings)"""
+        if column in self.codes:
+            return self.vocabularies[column][self.codes[column]]
+        if column == 'screen_size':
+            return self.numerics[column] / SCREEN_SIZE_SCALE
+        if column in self.numerics:
+            return self.numerics[column].astype(np.int64)
+        if column == 'model':
+            return np.array([self.model(i) for i in range(len(self))], dtype=object)
+        if column == 'id':
+            return self.ids.astype(np.int64)
+        raise KeyError(column)
+
+    def index_of(self, brand, model):
+        if self._model_index is None:
+            brands = self.column('brand')
+            self._model_index = {(brands[i], self.model(i)): i for i in range(len(self))}
+        return self._model_index.get((brand, model))
+
+
+def catalog_signature(conn):
+    """Trigger-maintained catalog version and the highest row id, both index lookups"""
+    return tuple(conn.execute(
+        "SELECT version, (SELECT MAX(id) FROM mobile_data) FROM catalog_version WHERE id = 1"
+    ).fetchone())
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def load_catalog(db_path='mobile_recommendations.db'):
+    """Shared catalog for db_path, reloaded only when the catalog version has moved"""
+    version = watch_catalog(db_path).poll()
+    with _catalogs_lock:
+        catalog = _catalogs.get(db_path)
+        if catalog is None or catalog.signature[0] != version:
+            catalog = MobileCatalog.from_db(db_path)
+            _catalogs[db_path] = catalog
+        return catalog
+
+
+def sample_profiles(catalog, num_profiles, seed=0):
+    """Preference profiles drawn from catalog phones, with the numerics nudged off the exact specs"""
+    rng = np.random.default_rng(seed)
+    profiles = []
+    for i in rng.choice(len(catalog), num_profiles):
+        prefs = catalog.record(int(i)).to_dict()
+        for key in ['id', 'brand', 'model']:
+            prefs.pop(key)
+        prefs['ram'] = int(rng.choice([4, 6, 8, 12, 16]))
+        prefs['battery_mah'] = int(prefs['battery_mah'] + rng.integers(-500, 500))
+        prefs['screen_size'] = round(float(prefs['screen_size']) + float(rng.uniform(-0.3, 0.3)), 1)
+        profiles.append(prefs)
+    return profiles
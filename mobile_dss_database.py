@@ -1,6 +1,96 @@
 import sqlite3
-import pandas as pd
 import random
+import re
+import sys
+import time
+
+MOBILE_DATA_COLUMNS = ['brand', 'model', 'price_range', 'ram', 'storage', 'camera_mp', 'battery_mah',
+                       'screen_size', 'operating_system', 'processor_type', 'network_type']
+INGEST_BATCH_ROWS = 50000
+
+# Spellings seen in vendor feeds, mapped to the values the catalog uses.
+OPERATING_SYSTEMS = {'ios': 'iOS', 'android': 'Android', 'harmonyos': 'HarmonyOS'}
+PRICE_RANGES = {value.lower(): value for value in ['Low', 'Low-Medium', 'Medium', 'Medium-High', 'High']}
+NUMBER_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*([a-z"]*)')
+# Only thousands separators are dropped; a decimal comma ("6,7") stays and is rejected.
+THOUSANDS_SEPARATOR = re.compile(r'(?<=\d),(?=\d{3}\b)')
+# Units feeds write inline, as the factor to this column's unit.
+SIZE_UNITS = {'': 1, 'gb': 1, 'mb': 1 / 1024, 'tb': 1024}
+FEED_UNITS = {
+    'ram': SIZE_UNITS,
+    'storage': SIZE_UNITS,
+    'camera_mp': {'': 1, 'mp': 1},
+    'battery_mah': {'': 1, 'mah': 1, 'ah': 1000},
+    'screen_size': {'': 1, '"': 1, 'in': 1, 'inch': 1, 'inches': 1, 'cm': 1 / 2.54}
+}
+# Plausible phone specs after unit conversion; anything outside is a feed error.
+FEED_LIMITS = {
+    'ram': (1, 128),
+    'storage': (1, 4096),
+    'camera_mp': (1, 500),
+    'battery_mah': (500, 30000),
+    'screen_size': (3.0, 12.0)
+}
+MAX_REPORTED_REJECTS = 10
+
+def ensure_catalog_versioning(conn):
+    """Add updated_at, the catalog_version counter, the changelog and the triggers that maintain them"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(mobile_data)")]
+    if 'updated_at' not in columns:
+        # ALTER TABLE cannot add a CURRENT_TIMESTAMP default; the insert trigger fills it in.
+        conn.execute("ALTER TABLE mobile_data ADD COLUMN updated_at TIMESTAMP")
+        conn.execute("UPDATE mobile_data SET updated_at = created_at")
+    
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS catalog_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    )
+    ''')
+    conn.execute("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS catalog_changelog (
+        version INTEGER PRIMARY KEY,
+        row_id INTEGER NOT NULL,
+        operation TEXT NOT NULL,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
+    # Every change bumps the version by one and logs it under the new
+    # version, so a gap in the changelog means it was pruned.
+    log_change = '''
+        UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+        INSERT INTO catalog_changelog (version, row_id, operation)
+        SELECT version, {row}.id, '{operation}' FROM catalog_version WHERE id = 1;
+    '''
+    changed = ' OR '.join(f"OLD.{col} IS NOT NEW.{col}" for col in MOBILE_DATA_COLUMNS)
+    conn.executescript(f'''
+    CREATE TRIGGER IF NOT EXISTS mobile_data_insert AFTER INSERT ON mobile_data
+    BEGIN
+        {log_change.format(row='NEW', operation='insert')}
+        UPDATE mobile_data SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id AND updated_at IS NULL;
+    END;
+    CREATE TRIGGER IF NOT EXISTS mobile_data_update AFTER UPDATE OF {', '.join(MOBILE_DATA_COLUMNS)} ON mobile_data
+    WHEN {changed}
+    BEGIN
+        {log_change.format(row='NEW', operation='update')}
+        UPDATE mobile_data SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+    END;
+    CREATE TRIGGER IF NOT EXISTS mobile_data_delete AFTER DELETE ON mobile_data
+    BEGIN
+        {log_change.format(row='OLD', operation='delete')}
+    END;
+    ''')
+    conn.commit()
+
+def prune_catalog_changelog(conn, keep_versions=100000):
+    """Drop changelog rows older than the last keep_versions changes"""
+    conn.execute(
+        "DELETE FROM catalog_changelog WHERE version <= (SELECT version FROM catalog_version WHERE id = 1) - ?",
+        (keep_versions,)
+    )
+    conn.commit()
 
 def create_database():
     conn = sqlite3.connect('mobile_recommendations.db')
@@ -20,9 +110,11 @@ def create_database():
         operating_system TEXT NOT NULL,
         processor_type TEXT NOT NULL,
         network_type TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
     ''')
+    ensure_catalog_versioning(conn)
     
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS user_choices (
@@ -116,6 +208,7 @@ def create_database():
 
 def get_mobile_data():
     """Retrieve all mobile data from database"""
+    import pandas as pd
     conn = sqlite3.connect('mobile_recommendations.db')
     df = pd.read_sql_query("SELECT * FROM mobile_data", conn)
     conn.close()
@@ -123,6 +216,7 @@ def get_mobile_data():
 
 def get_user_choices():
     """Retrieve all user choice data from database"""
+    import pandas as pd
     conn = sqlite3.connect('mobile_recommendations.db')
     df = pd.read_sql_query("SELECT * FROM user_choices", conn)
     conn.close()
@@ -143,7 +237,167 @@ def add_user_choice(choice_data):
     conn.commit()
     conn.close()
 
-if __name__ == "__main__":
+def read_feed(path):
+    """Stream raw records from a CSV or JSONL feed (optionally gzipped), one at a time.
+
+    JSONL lines come through unparsed and an unreadable CSV row as its
+    csv.Error, so normalize_feed_record rejects a bad line on its own
+    instead of ending the whole feed.
+    """
+    import csv
+    import gzip
+    name = path[:-3] if path.endswith('.gz') else path
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        if name.endswith(('.jsonl', '.ndjson', '.json')):
+            for line in f:
+                if line.strip():
+                    yield line
+        else:
+            reader = csv.DictReader(f)
+            while True:
+                try:
+                    yield next(reader)
+                except StopIteration:
+                    return
+                except csv.Error as e:
+                    yield e
+
+def normalize_feed_record(record):
+    """Validate a raw feed record and return it as a mobile_data row tuple; raises ValueError if unusable"""
+    if isinstance(record, Exception):
+        raise ValueError(f"unreadable row: {record}")
+    if isinstance(record, str):
+        import json
+        # JSONDecodeError is a ValueError.
+        record = json.loads(record)
+        if not isinstance(record, dict):
+            raise ValueError("not a JSON object")
+    record = {str(key).strip().lower().replace(' ', '_'): value for key, value in record.items()}
+    row = []
+    for col in MOBILE_DATA_COLUMNS:
+        value = record.get(col)
+        if value is None or str(value).strip() == '':
+            raise ValueError(f"missing {col}")
+        if col in FEED_UNITS:
+            # Feeds write units inline ("8GB", "1TB", "5000 mAh", '6.7"').
+            match = NUMBER_PATTERN.fullmatch(THOUSANDS_SEPARATOR.sub('', str(value)).strip().lower())
+            if match is None:
+                raise ValueError(f"{col} is not a number: {value!r}")
+            number, unit = match.groups()
+            if unit not in FEED_UNITS[col]:
+                raise ValueError(f"{col} has an unknown unit: {value!r}")
+            number = float(number) * FEED_UNITS[col][unit]
+            if number <= 0:
+                raise ValueError(f"{col} must be positive: {value!r}")
+            number = round(number, 2) if col == 'screen_size' else int(round(number))
+            low, high = FEED_LIMITS[col]
+            if not low <= number <= high:
+                raise ValueError(f"{col} {value!r} is outside {low}-{high}")
+            value = number
+        else:
+            value = ' '.join(str(value).split())
+            if col in ('price_range', 'operating_system'):
+                # Catalog categories are fixed; an unknown value is a typo, not a new category.
+                known = PRICE_RANGES if col == 'price_range' else OPERATING_SYSTEMS
+                canonical = known.get(value.lower().replace(' ', ''))
+                if canonical is None:
+                    raise ValueError(f"unknown {col} {value!r}, expected one of {sorted(known.values())}")
+                value = canonical
+            elif col == 'network_type':
+                value = value.upper()
+        row.append(value)
+    return tuple(row)
+
+def normalized_rows(records, rejected):
+    """Normalized rows of records; rejected counts the bad ones and keeps the first few line numbers"""
+    for line, record in enumerate(records, 1):
+        try:
+            yield normalize_feed_record(record)
+        except (ValueError, TypeError, AttributeError) as e:
+            rejected['count'] += 1
+            if rejected['count'] <= MAX_REPORTED_REJECTS:
+                rejected['lines'].append(line)
+                print(f"Skipping record {line}: {e}")
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def ingest_catalog_feed(feed_path, db_path='mobile_recommendations.db', batch_size=INGEST_BATCH_ROWS,
+                        rebuild_features=True):
+    """Upsert a vendor feed into mobile_data on (brand, model) in constant memory"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA synchronous = NORMAL")
+    ensure_catalog_versioning(conn)
+    try:
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS mobile_data_brand_model ON mobile_data (brand, model)")
+    except sqlite3.IntegrityError:
+        duplicates = conn.execute(
+            "SELECT brand, model, COUNT(*) FROM mobile_data GROUP BY brand, model HAVING COUNT(*) > 1 LIMIT 5"
+        ).fetchall()
+        conn.close()
+        listed = ', '.join(f"{brand} {model} ({count} rows)" for brand, model, count in duplicates)
+        print(f"Cannot ingest into {db_path}: feeds upsert on (brand, model), but mobile_data already "
+              f"has duplicates, e.g. {listed}. Remove the duplicate rows and run the ingest again.")
+        return None
+    
+    updated = [col for col in MOBILE_DATA_COLUMNS if col not in ('brand', 'model')]
+    upsert = f'''
+    INSERT INTO mobile_data ({', '.join(MOBILE_DATA_COLUMNS)})
+    VALUES ({', '.join('?' * len(MOBILE_DATA_COLUMNS))})
+    ON CONFLICT (brand, model) DO UPDATE SET {', '.join(f"{col} = excluded.{col}" for col in updated)}
+    WHERE {' OR '.join(f"{col} IS NOT excluded.{col}" for col in updated)}
+    '''
+    
+    version_query = "SELECT version FROM catalog_version WHERE id = 1"
+    first_version = conn.execute(version_query).fetchone()[0]
+    rejected = {'count': 0, 'lines': []}
+    rows_read = 0
+    start = time.perf_counter()
+    try:
+        for batch in batches(normalized_rows(read_feed(feed_path), rejected), batch_size):
+            conn.executemany(upsert, batch)
+            conn.commit()
+            rows_read += len(batch)
+            print(f"Committed {rows_read} rows ({rows_read / (time.perf_counter() - start):,.0f} rows/s)")
+        # The triggers log one version per inserted or actually changed row.
+        changed = conn.execute(version_query).fetchone()[0] - first_version
+        # A large feed would otherwise leave a changelog row per changed phone
+        # behind; watchers further back than this just reload everything.
+        prune_catalog_changelog(conn)
+    finally:
+        conn.close()
+    
+    elapsed = time.perf_counter() - start
+    print(f"Ingested {rows_read} rows in {elapsed:.1f}s ({rows_read / max(elapsed, 1e-9):,.0f} rows/s): "
+          f"{changed} inserted or changed, {rejected['count']} rejected")
+    if rebuild_features and changed:
+        # One re-encode for the whole feed instead of one per batch.
+        from feature_store import build_feature_store
+        build_start = time.perf_counter()
+        store = build_feature_store(db_path)
+        print(f"Rebuilt feature store for {len(store)} phones in {time.perf_counter() - build_start:.1f}s")
+    return {'rows': rows_read, 'changed': changed, 'rejected': rejected['count'], 'rejected_lines': rejected['lines'], 'seconds': elapsed}
+
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == 'ingest':
+    import argparse
+    parser = argparse.ArgumentParser(prog='mobile_dss_database.py ingest',
+                                     description="Stream a CSV or JSONL catalog feed into mobile_data")
+    parser.add_argument('feed', help="path to a .csv or .jsonl feed, optionally .gz")
+    parser.add_argument('--db', default='mobile_recommendations.db')
+    parser.add_argument('--batch-size', type=int, default=INGEST_BATCH_ROWS)
+    parser.add_argument('--no-rebuild', action='store_true', help="skip re-encoding the feature store")
+    args = parser.parse_args(sys.argv[2:])
+    if ingest_catalog_feed(args.feed, args.db, args.batch_size, not args.no_rebuild) is None:
+        sys.exit(1)
+elif __name__ == "__main__":
     create_database()
     print("Mobile data sample:")
     print(get_mobile_data().head())
@@ -0,0 +1,170 @@
+import json
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+import numpy as np
+from feature_store import FEATURE_COLUMNS, CATEGORICAL_FEATURES, NUMERIC_FEATURES
+
+CHOICE_COLUMNS = ['id', 'chosen_brand', 'chosen_model'] + FEATURE_COLUMNS
+
+
+def _segment(price_range, operating_system):
+    return f"{price_range}|{operating_system}"
+
+
+class OnlinePreferenceModel:
+    """Incrementally learned preferences from the user_choices history.
+
+    Brand choice counts are kept per price range, per operating system and
+    per (price range, operating system) segment, which is enough to answer
+    the historical brand bonus exactly without rescanning the history.
+    Per-segment feature weights start at the expert system's feature_weights
+    and move towards the features users in that segment actually matched
+    on. Every update is O(1); ``sync()`` only reads choices newer than the
+    last one seen, and the state is snapshotted to SQLite periodically.
+    """
+
+    def __init__(self, db_path, prior_weights, learning_rate=0.05, snapshot_every=100):
+        self.db_path = db_path
+        self.prior = np.array([prior_weights[f] for f in FEATURE_COLUMNS], dtype=np.float64)
+        self.prior = self.prior / self.prior.sum()
+        self.learning_rate = learning_rate
+        self.snapshot_every = snapshot_every
+        self.lock = threading.Lock()
+        self.reset()
+        self.restore()
+
+    def reset(self):
+        self.price_counts = defaultdict(Counter)
+        self.os_counts = defaultdict(Counter)
+        self.segment_counts = defaultdict(Counter)
+        self.segment_weights = {}
+        self.last_choice_id = 0
+        self.updates_since_snapshot = 0
+
+    def observe(self, choice, phone=None, scale=None):
+        """Fold one user_choices row into the model"""
+        price_range = str(choice['price_range'])
+        operating_system = str(choice['operating_system'])
+        segment = _segment(price_range, operating_system)
+        brand = choice['chosen_brand']
+        self.price_counts[price_range][brand] += 1
+        self.os_counts[operating_system][brand] += 1
+        self.segment_counts[segment][brand] += 1
+        if phone is not None:
+            self.update_weights(segment, choice, phone, scale)
+        self.last_choice_id = max(self.last_choice_id, int(choice['id']))
+        self.updates_since_snapshot += 1
+
+    def update_weights(self, segment, choice, phone, scale):
+        agreement = np.empty(len(FEATURE_COLUMNS))
+        for j, feature in enumerate(FEATURE_COLUMNS):
+            if feature in CATEGORICAL_FEATURES:
+                agreement[j] = 1.0 if str(choice[feature]) == str(phone[feature]) else 0.0
+            else:
+                distance = abs(float(choice[feature]) - float(phone[feature])) / scale[NUMERIC_FEATURES.index(feature)]
+                agreement[j] = 1.0 / (1.0 + distance)
+        target = self.prior * agreement
+        if target.sum() <= 0:
+            return
+        weights = self.segment_weights.get(segment, self.prior)
+        weights = (1 - self.learning_rate) * weights + self.learning_rate * target / target.sum()
+        self.segment_weights[segment] = weights / weights.sum()
+
+    def weights_for(self, user_prefs):
+        """Learned feature weights for the preference's segment, or the prior"""
+        segment = _segment(user_prefs['price_range'], user_prefs['operating_system'])
+        return self.segment_weights.get(segment, self.prior)
+
+    def historical_bonus_by_brand(self, user_prefs, brands):
+        """Brand share among past choices matching the price range or the OS, times 0.1"""
+        price_range = str(user_prefs['price_range'])
+        operating_system = str(user_prefs['operating_system'])
+        by_price = self.price_counts.get(price_range, Counter())
+        by_os = self.os_counts.get(operating_system, Counter())
+        by_segment = self.segment_counts.get(_segment(price_range, operating_system), Counter())
+        total = sum(by_price.values()) + sum(by_os.values()) - sum(by_segment.values())
+        bonus = np.zeros(len(brands))
+        if total == 0:
+            return bonus
+        for i, brand in enumerate(brands):
+            count = by_price.get(brand, 0) + by_os.get(brand, 0) - by_segment.get(brand, 0)
+            if count:
+                bonus[i] = count / total * 0.1
+        return bonus
+
+    def sync(self, catalog=None, feature_store=None):
+        """Apply user_choices rows recorded since the last sync"""
+        with self.lock:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                rows = conn.execute(
+                    f"SELECT {', '.join(CHOICE_COLUMNS)} FROM user_choices WHERE id > ? ORDER BY id",
+                    (self.last_choice_id,)
+                ).fetchall()
+            finally:
+                conn.close()
+            for row in rows:
+                choice = dict(zip(CHOICE_COLUMNS, row))
+                phone = None
+                if catalog is not None and feature_store is not None:
+                    index = catalog.index_of(choice['chosen_brand'], choice['chosen_model'])
+                    if index is not None:
+                        phone = catalog.record(index)
+                self.observe(choice, phone, feature_store.scale if phone is not None else None)
+            if self.updates_since_snapshot >= self.snapshot_every:
+                self.snapshot()
+            return len(rows)
+
+    def state(self):
+        return {
+            'last_choice_id': self.last_choice_id,
+            'price_counts': self.price_counts,
+            'os_counts': self.os_counts,
+            'segment_counts': self.segment_counts,
+            'segment_weights': {segment: w.tolist() for segment, w in self.segment_weights.items()},
+            'prior': self.prior.tolist()
+        }
+
+    def snapshot(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            conn.execute('''
+            CREATE TABLE IF NOT EXISTS preference_model_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_choice_id INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
+            conn.execute('''
+            INSERT OR REPLACE INTO preference_model_state (id, last_choice_id, state, updated_at)
+            VALUES (1, ?, ?, CURRENT_TIMESTAMP)
+            ''', (self.last_choice_id, json.dumps(self.state())))
+            conn.commit()
+        finally:
+            conn.close()
+        self.updates_since_snapshot = 0
+
+    def restore(self):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            row = conn.execute("SELECT state FROM preference_model_state WHERE id = 1").fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        finally:
+            conn.close()
+        if row is None:
+            return False
+        state = json.loads(row[0])
+        if not np.allclose(state['prior'], self.prior):
+            # The expert weights changed since the snapshot; relearn from the prior.
+            return False
+        self.last_choice_id = state['last_choice_id']
+        for name in ['price_counts', 'os_counts', 'segment_counts']:
+            counts = defaultdict(Counter)
+            for key, brand_counts in state[name].items():
+                counts[key] = Counter(brand_counts)
+            setattr(self, name, counts)
+        self.segment_weights = {segment: np.array(w) for segment, w in state['segment_weights'].items()}
+        return True
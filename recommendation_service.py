@@ -0,0 +1,163 @@
+import asyncio
+import os
+import threading
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel
+from expert_system import MobileExpertSystem
+from local_llm_client import RemoteLLMRecommender
+
+DB_PATH = os.environ.get('DSS_DB_PATH', 'mobile_recommendations.db')
+LLM_URL = os.environ.get('DSS_LLM_URL', '')
+SCORING_WORKERS = int(os.environ.get('DSS_SCORING_WORKERS', '0'))
+SIMILARITY_KERNEL = os.environ.get('DSS_SIMILARITY_KERNEL', 'cosine')
+
+
+class UserPreferences(BaseModel):
+    price_range: str
+    ram: int
+    storage: int
+    camera_mp: int
+    battery_mah: int
+    screen_size: float
+    operating_system: str
+    processor_type: str
+    network_type: str
+
+
+class RecommendationRequest(BaseModel):
+    user_preferences: UserPreferences
+    num_recommendations: int = 8
+    generation_mode: Optional[str] = None
+    max_new_tokens: Optional[int] = None
+
+
+class CombinedRecommendationRequest(BaseModel):
+    user_preferences: UserPreferences
+    num_expert_recommendations: int = 8
+    num_llm_recommendations: int = 2
+    generation_mode: Optional[str] = None
+    max_new_tokens: Optional[int] = None
+
+
+class ChoiceRequest(BaseModel):
+    user_preferences: UserPreferences
+    brand: str
+    model: str
+    source: str = 'Expert System'
+
+
+class RecommendationState:
+    """Warm expert system and LLM client shared by every request in this worker"""
+
+    def __init__(self, db_path=DB_PATH, llm_url=LLM_URL, num_workers=SCORING_WORKERS, kernel=SIMILARITY_KERNEL):
+        self.expert_system = MobileExpertSystem(db_path, num_workers=num_workers, kernel=kernel)
+        self.expert_lock = threading.Lock()
+        self.llm_client = RemoteLLMRecommender(llm_url, db_path) if llm_url else None
+
+    def warm_up(self):
+        with self.expert_lock:
+            self.expert_system.load_data()
+            self.expert_system.preprocess_data()
+        if self.llm_client is not None:
+            # The client builds its fallback ranking in the background; wait
+            # for it so the worker only reports ready once it is in place.
+            self.llm_client.fallback_ranking(self.llm_client.load_mobile_data())
+
+    def expert_recommendations(self, user_preferences, num_recommendations):
+        # The expert system swaps its catalog and feature store in place when
+        # the database changes, so requests in this worker take turns.
+        with self.expert_lock:
+            recommendations = self.expert_system.get_expert_recommendations(user_preferences, num_recommendations)
+        return [rec.to_dict() for rec in recommendations]
+
+    def llm_recommendations(self, user_preferences, num_recommendations, generation_mode=None, max_new_tokens=None):
+        if self.llm_client is None:
+            return []
+        recommendations = self.llm_client.get_llm_recommendations(
+            user_preferences, num_recommendations, generation_mode, max_new_tokens
+        )
+        return [rec.to_dict() for rec in recommendations]
+
+    def close(self):
+        self.expert_system.close()
+        if self.llm_client is not None:
+            self.llm_client.close()
+
+
+state = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global state
+    state = RecommendationState()
+    await run_in_threadpool(state.warm_up)
+    yield
+    state.close()
+
+
+app = FastAPI(title="Mobile Phone Recommendation Service", lifespan=lifespan)
+
+
+@app.get('/health')
+async def health():
+    return {
+        'status': 'healthy',
+        'catalog_size': len(state.expert_system.catalog),
+        'llm_configured': state.llm_client is not None,
+        'llm_coalescing': state.llm_client.coalescing_stats() if state.llm_client is not None else None
+    }
+
+
+@app.post('/recommend/expert')
+async def recommend_expert(request: RecommendationRequest):
+    recommendations = await run_in_threadpool(
+        state.expert_recommendations, request.user_preferences.model_dump(), request.num_recommendations
+    )
+    return {'recommendations': recommendations}
+
+
+@app.post('/recommend/llm')
+async def recommend_llm(request: RecommendationRequest):
+    if state.llm_client is None:
+        raise HTTPException(status_code=503, detail="LLM service URL is not configured (set DSS_LLM_URL)")
+    recommendations = await run_in_threadpool(
+        state.llm_recommendations, request.user_preferences.model_dump(), request.num_recommendations,
+        request.generation_mode, request.max_new_tokens
+    )
+    return {'recommendations': recommendations}
+
+
+@app.post('/recommend')
+async def recommend_combined(request: CombinedRecommendationRequest):
+    user_preferences = request.user_preferences.model_dump()
+    expert_recommendations, llm_recommendations = await asyncio.gather(
+        run_in_threadpool(state.expert_recommendations, user_preferences, request.num_expert_recommendations),
+        run_in_threadpool(state.llm_recommendations, user_preferences, request.num_llm_recommendations,
+                          request.generation_mode, request.max_new_tokens)
+    )
+    return {'expert_recommendations': expert_recommendations, 'llm_recommendations': llm_recommendations}
+
+
+@app.post('/choices', status_code=201)
+async def record_choice(request: ChoiceRequest):
+    await run_in_threadpool(
+        state.expert_system.save_user_choice,
+        request.user_preferences.model_dump(),
+        {'brand': request.brand, 'model': request.model},
+        request.source
+    )
+    return {'saved': True}
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(
+        'recommendation_service:app',
+        host=os.environ.get('DSS_HOST', '0.0.0.0'),
+        port=int(os.environ.get('DSS_PORT', '8000')),
+        workers=int(os.environ.get('DSS_HTTP_WORKERS', '1'))
+    )
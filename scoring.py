@@ -0,0 +1,132 @@
+import os
+import numpy as np
+from feature_store import FeatureStore, FEATURE_COLUMNS
+from tracing import span
+
+SHARD_MIN_ROWS = 50000
+BATCH_CELLS = 4000000
+
+RAM, STORAGE, CAMERA, BATTERY, SCREEN = (FEATURE_COLUMNS.index(col) for col in
+                                         ['ram', 'storage', 'camera_mp', 'battery_mah', 'screen_size'])
+PRICE, OS, NETWORK = (FEATURE_COLUMNS.index(col) for col in
+                      ['price_range', 'operating_system', 'network_type'])
+
+
+def apply_expert_rules_vectorized(query, encoded):
+    """MobileExpertSystem.apply_expert_rules for a block of label-encoded rows.
+
+    Query values may be scalars or (profiles, 1) columns, in which case the
+    result broadcasts to one row of bonuses per profile.
+    """
+    prefs = query['numeric_preferences']
+
+    bonus = np.where(encoded[:, PRICE] == query['price_code'], 0.2, 0.0)
+    bonus = bonus + np.where(encoded[:, RAM] >= prefs['ram'], 0.1, -0.15)
+    bonus = bonus + np.where(encoded[:, STORAGE] >= prefs['storage'], 0.1, -0.1)
+    bonus = bonus + np.where(encoded[:, OS] == query['os_code'], 0.15, 0.0)
+    bonus = bonus + np.where((prefs['camera_mp'] >= 48) & (encoded[:, CAMERA] >= 48), 0.1, 0.0)
+    bonus = bonus + np.where((prefs['battery_mah'] >= 4500) & (encoded[:, BATTERY] >= 4500), 0.08, 0.0)
+    network_5g_code = query['network_5g_code']
+    bonus = bonus + np.where((network_5g_code >= 0) & (encoded[:, NETWORK] == network_5g_code), 0.05, 0.0)
+    size_diff = np.abs(encoded[:, SCREEN] - prefs['screen_size'])
+    bonus = bonus + np.where(size_diff <= 0.3, 0.05, np.where(size_diff > 1.0, -0.05, 0.0))
+
+    return bonus
+
+
+def score_rows(store, query, start=0, stop=None):
+    """Similarity, rule bonus, historical bonus and final score for catalog rows start:stop"""
+    return score_candidates(store, query, slice(start, stop))
+
+
+def score_candidates(store, query, rows):
+    """score_rows for a slice or an index array of catalog rows"""
+    encoded = store.encoded[rows]
+    scores = np.empty((len(encoded), 4))
+    with span('expert.similarity', kernel=query['kernel']):
+        scores[:, 0] = store.similarity(query['kernel_query'], query['kernel'], rows)
+    with span('expert.rules'):
+        scores[:, 1] = apply_expert_rules_vectorized(query, encoded)
+    scores[:, 2] = query['brand_bonus'][store.brands[rows]]
+    scores[:, 3] = scores[:, 0] + scores[:, 1] + scores[:, 2]
+    return scores
+
+
+def score_batch(store, batch, start=0, stop=None):
+    """score_rows for many profiles at once; returns four (profiles, rows) matrices"""
+    rows = slice(start, stop)
+    similarity = store.batch_similarity(batch['kernel_queries'], batch['kernel'], rows)
+    rule_bonus = apply_expert_rules_vectorized(batch, store.encoded[rows])
+    historical_bonus = batch['brand_bonus'][:, store.brands[rows]]
+    return similarity, rule_bonus, historical_bonus, similarity + rule_bonus + historical_bonus
+
+
+def top_k_indices(final_scores, k):
+    """Indices of the k best scores, ties broken by lower index (same as a stable sort); NaN ranks last"""
+    keys = -np.nan_to_num(final_scores, nan=-np.inf)
+    if k >= len(final_scores):
+        return np.argsort(keys, kind='stable')
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    kth = np.partition(keys, k - 1)[k - 1]
+    candidates = np.flatnonzero(keys <= kth)
+    order = np.argsort(keys[candidates], kind='stable')
+    return candidates[order][:k]
+
+
+def merge_top_k(indices, scores, k):
+    order = np.lexsort((indices, -scores[:, 3]))[:k]
+    return indices[order], scores[order]
+
+
+_worker_stores = {}
+
+
+def _score_shard(build_dir, query, start, stop, k):
+    store = _worker_stores.get(build_dir)
+    if store is None:
+        _worker_stores.clear()
+        store = FeatureStore.load_build(build_dir)
+        _worker_stores[build_dir] = store
+    scores = score_rows(store, query, start, stop)
+    local = top_k_indices(scores[:, 3], k)
+    return local + start, scores[local]
+
+
+class ShardedScorer:
+    """Scores contiguous catalog shards in a process pool and merges each worker's top-k.
+
+    Workers memory-map the same feature store build, so each shard is read
+    from shared page-cache memory rather than pickled to the worker.
+    """
+
+    def __init__(self, num_workers=None, min_rows_per_shard=SHARD_MIN_ROWS):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.min_rows_per_shard = min_rows_per_shard
+        self.executor = None
+
+    def shards(self, num_rows):
+        count = max(1, min(self.num_workers, num_rows // max(self.min_rows_per_shard, 1)))
+        bounds = np.linspace(0, num_rows, count + 1).astype(int)
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def score_top_k(self, store, query, k):
+        shards = self.shards(len(store))
+        if len(shards) == 1:
+            scores = score_rows(store, query)
+            indices = top_k_indices(scores[:, 3], k)
+            return indices, scores[indices]
+        if self.executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(max_workers=self.num_workers)
+        futures = [self.executor.submit(_score_shard, store.path, query, start, stop, k)
+                   for start, stop in shards]
+        results = [future.result() for future in futures]
+        indices = np.concatenate([result[0] for result in results])
+        scores = np.concatenate([result[1] for result in results])
+        return merge_top_k(indices, scores, k)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
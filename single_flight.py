@@ -0,0 +1,98 @@
+import hashlib
+import json
+import threading
+
+
+def canonical_key(*parts):
+    """Stable string for a request, so equivalent preference dicts (key order, 8 vs 8.0) coalesce"""
+    def canonical(value):
+        if isinstance(value, dict):
+            return {str(k): canonical(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [canonical(v) for v in value]
+        if isinstance(value, bool) or value is None:
+            return value
+        if isinstance(value, (int, float)):
+            return float(value)
+        if hasattr(value, 'item'):
+            return canonical(value.item())
+        return str(value).strip()
+    return json.dumps(canonical(list(parts)), sort_keys=True, separators=(',', ':'))
+
+
+def text_digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time.
+
+    Callers that arrive while a call for the same key is in flight wait for
+    it and share its result (or exception) instead of starting their own.
+    Nothing is cached: once the call returns, the next caller starts afresh.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.requests = 0
+        self.executions = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """(result, shared) of func(*args, **kwargs), where shared means another caller's run was reused"""
+        with self.lock:
+            self.requests += 1
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.executions += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self.lock:
+            coalesced = self.requests - self.executions
+            return {
+                'requests': self.requests,
+                'executions': self.executions,
+                'coalesced': coalesced,
+                'coalescing_ratio': round(coalesced / self.requests, 4) if self.requests else 0.0,
+                'in_flight': len(self.calls)
+            }
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def single_flight(name):
+    """Shared SingleFlight for name, so every client of one upstream coalesces together"""
+    with _flights_lock:
+        flight = _flights.get(name)
+        if flight is None:
+            flight = _flights[name] = SingleFlight()
+        return flight
@@ -3,10 +3,7 @@ import pandas as pd
 import sqlite3
 from expert_system import MobileExpertSystem
 from local_llm_client import RemoteLLMRecommender
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime
-import time
+from tracing import tracer, span, timed
 
 st.set_page_config(
     page_title="Mobile Phone Recommendation DSS",
@@ -131,6 +128,8 @@ class MobileRecommendationApp:
             if 'llm_client' not in st.session_state or st.session_state.get('colab_url') != colab_url:
                 try:
                     with st.spinner("Connecting to Colab LLM service..."):
+                        if st.session_state.get('llm_client') is not None:
+                            st.session_state.llm_client.close()
                         self.llm_client = RemoteLLMRecommender(colab_url)
                         st.session_state.llm_client = self.llm_client
                         st.session_state.colab_url = colab_url
@@ -154,6 +153,18 @@ class MobileRecommendationApp:
                 )
                 if 'llm_error' in st.session_state:
                     st.sidebar.error(f"Error: {st.session_state.llm_error}")
+            st.sidebar.selectbox(
+                "LLM Generation Mode",
+                ['service default', 'assisted', 'standard', 'fast', 'auto'],
+                key='generation_mode',
+                help="assisted: small draft model proposes tokens the large model verifies; "
+                     "fast: small model only; auto: fast for small catalogs"
+            )
+            st.sidebar.slider(
+                "LLM Token Budget", 128, 2048, 768, step=64,
+                key='max_new_tokens',
+                help="Most new tokens the LLM may generate; it stops earlier once its JSON answer is complete"
+            )
         else:
             st.sidebar.info("Enter Colab URL to enable LLM recommendations")
     
@@ -320,6 +331,7 @@ class MobileRecommendationApp:
                 st.markdown("---")
     
     def display_analytics(self):
+        import plotly.express as px
         st.markdown("### System Analytics")
         
         conn = sqlite3.connect(self.db_path)
@@ -372,6 +384,21 @@ class MobileRecommendationApp:
         
         conn.close()
     
+    def display_latency_breakdown(self):
+        stages = tracer.snapshot()
+        with st.sidebar.expander("Latency Breakdown"):
+            if self.llm_client is not None:
+                coalescing = self.llm_client.coalescing_stats()
+                st.caption(f"LLM requests: {coalescing['requests']}, shared with an identical in-flight "
+                           f"request: {coalescing['coalesced']} ({coalescing['coalescing_ratio']:.0%})")
+            if not stages:
+                st.caption("No requests timed yet.")
+                return
+            breakdown = pd.DataFrame.from_dict(stages, orient='index')
+            breakdown = breakdown[['count', 'last_ms', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms']]
+            st.dataframe(breakdown.round(2), use_container_width=True)
+    
+    @timed('app.save_choice')
     def save_final_choice(self, user_preferences, chosen_mobile, source):
         choice_data = (
             user_preferences['price_range'],
@@ -415,13 +442,20 @@ class MobileRecommendationApp:
             user_preferences = self.get_user_preferences()
             
             if st.sidebar.button("Get Recommendations", type="primary"):
-                with st.spinner("Generating recommendations..."):
-                    expert_recommendations = self.expert_system.get_expert_recommendations(user_preferences, 8)
+                with st.spinner("Generating recommendations..."), span('app.request'):
+                    with span('app.expert_recommendations'):
+                        expert_recommendations = self.expert_system.get_expert_recommendations(user_preferences, 8)
                     
                     llm_recommendations = []
                     if st.session_state.get('llm_connected', False) and self.llm_client:
                         try:
-                            llm_recommendations = self.llm_client.get_llm_recommendations(user_preferences, 2)
+                            with span('app.llm_recommendations'):
+                                generation_mode = st.session_state.get('generation_mode', 'service default')
+                                llm_recommendations = self.llm_client.get_llm_recommendations(
+                                    user_preferences, 2,
+                                    None if generation_mode == 'service default' else generation_mode,
+                                    st.session_state.get('max_new_tokens')
+                                )
                         except Exception as e:
                             st.error(f"LLM service error: {e}")
                             llm_recommendations = []
@@ -464,6 +498,8 @@ class MobileRecommendationApp:
                             self.save_final_choice(st.session_state.user_prefs, selected_mobile, source)
                             st.success(f"Thank you! Your choice of {selected_choice} has been saved to improve future recommendations.")
                             st.balloons()
+        
+        self.display_latency_breakdown()
 
 if __name__ == "__main__":
     app = MobileRecommendationApp()
@@ -0,0 +1,266 @@
+import bisect
+import contextlib
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+
+# Upper bounds of the latency histogram buckets, in milliseconds.
+BUCKET_BOUNDS_MS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500,
+                    1000, 2500, 5000, 10000, 30000, 60000, float('inf')]
+
+PROFILE_MODE = os.environ.get('DSS_PROFILE', '').lower()
+PROFILE_DIR = os.environ.get('DSS_PROFILE_DIR', 'profiles')
+OTLP_ENDPOINT = os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT', '')
+SERVICE_NAME = os.environ.get('OTEL_SERVICE_NAME', 'mobile-dss')
+
+
+class StageHistogram:
+    """Fixed-bucket latency histogram for one pipeline stage"""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKET_BOUNDS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = 0.0
+
+    def observe(self, duration_ms):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS_MS, duration_ms)] += 1
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.last_ms = duration_ms
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (capped at the observed max)"""
+        if self.count == 0:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS_MS, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else 0.0,
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'max_ms': self.max_ms,
+            'last_ms': self.last_ms,
+            'total_ms': self.total_ms
+        }
+
+
+class OTLPJsonExporter:
+    """Sends finished spans to an OTLP/HTTP collector as JSON (POST {endpoint}/v1/traces)"""
+
+    def __init__(self, endpoint, service_name=SERVICE_NAME, timeout=2):
+        self.url = endpoint.rstrip('/') + '/v1/traces'
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def payload(self, spans):
+        return {'resourceSpans': [{
+            'resource': {'attributes': [_attribute('service.name', self.service_name)]},
+            'scopeSpans': [{
+                'scope': {'name': 'mobile-dss.tracing'},
+                'spans': [{
+                    'traceId': span['trace_id'],
+                    'spanId': span['span_id'],
+                    'parentSpanId': span['parent_id'] or '',
+                    'name': span['name'],
+                    'kind': 1,
+                    'startTimeUnixNano': str(span['start_ns']),
+                    'endTimeUnixNano': str(span['end_ns']),
+                    'attributes': [_attribute(k, v) for k, v in span['attributes'].items()]
+                } for span in spans]
+            }]
+        }]}
+
+    def export(self, spans):
+        import urllib.request
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(self.payload(spans)).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        try:
+            urllib.request.urlopen(request, timeout=self.timeout).close()
+            return True
+        except OSError as e:
+            print(f"Trace export to {self.url} failed: {e}")
+            return False
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+class Tracer:
+    """Per-stage timers with in-process histograms and optional span export.
+
+    ``span(name)`` is a context manager and ``timed(name)`` its decorator form.
+    Spans nest per thread, so exported traces keep the request structure.
+    """
+
+    def __init__(self, exporter=None, export_interval=5.0, max_buffered_spans=10000):
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.exporter = exporter
+        self.export_interval = export_interval
+        self.pending = deque(maxlen=max_buffered_spans)
+        self.export_thread = None
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        parent = stack[-1] if stack else None
+        trace_id = parent[0] if parent else uuid.uuid4().hex
+        span_id = uuid.uuid4().hex[:16]
+        stack.append((trace_id, span_id))
+        start_ns = time.time_ns()
+        start = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            duration_ms = (time.perf_counter() - start) * 1000
+            stack.pop()
+            with self.lock:
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = StageHistogram()
+                histogram.observe(duration_ms)
+                if self.exporter is not None:
+                    self.pending.append({
+                        'trace_id': trace_id,
+                        'span_id': span_id,
+                        'parent_id': parent[1] if parent else None,
+                        'name': name,
+                        'start_ns': start_ns,
+                        'end_ns': start_ns + int(duration_ms * 1e6),
+                        'attributes': attributes
+                    })
+            if self.exporter is not None:
+                self._ensure_export_thread()
+
+    def timed(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextlib.contextmanager
+    def profile(self, name):
+        """Capture a cProfile or pyinstrument profile of the block when DSS_PROFILE is set"""
+        if PROFILE_MODE not in ('cprofile', 'pyinstrument') or getattr(self.local, 'profiling', False):
+            yield
+            return
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}")
+        self.local.profiling = True
+        try:
+            if PROFILE_MODE == 'cprofile':
+                import cProfile
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    yield
+                finally:
+                    profiler.disable()
+                    profiler.dump_stats(path + '.prof')
+            else:
+                from pyinstrument import Profiler
+                profiler = Profiler()
+                profiler.start()
+                try:
+                    yield
+                finally:
+                    profiler.stop()
+                    with open(path + '.html', 'w') as f:
+                        f.write(profiler.output_html())
+        finally:
+            self.local.profiling = False
+
+    def snapshot(self):
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+
+    def flush(self):
+        if self.exporter is None:
+            return
+        with self.lock:
+            spans = list(self.pending)
+            self.pending.clear()
+        if spans:
+            self.exporter.export(spans)
+
+    def _ensure_export_thread(self):
+        if self.export_thread is not None:
+            return
+        with self.lock:
+            if self.export_thread is not None:
+                return
+            self.export_thread = threading.Thread(target=self._export_loop, daemon=True)
+            self.export_thread.start()
+
+    def _export_loop(self):
+        while True:
+            time.sleep(self.export_interval)
+            self.flush()
+
+
+tracer = Tracer(OTLPJsonExporter(OTLP_ENDPOINT) if OTLP_ENDPOINT else None)
+span = tracer.span
+timed = tracer.timed
+profile = tracer.profile
+
+
+def run_collector(port=4318):
+    """Minimal stand-in for an OTLP/HTTP collector that prints received spans"""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class CollectorHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self.send_response(200)
+            self.end_headers()
+            for resource_spans in json.loads(body).get('resourceSpans', []):
+                for scope_spans in resource_spans.get('scopeSpans', []):
+                    for s in scope_spans.get('spans', []):
+                        duration_ms = (int(s['endTimeUnixNano']) - int(s['startTimeUnixNano'])) / 1e6
+                        print(f"{s['traceId'][:8]} {s['name']:<32} {duration_ms:9.3f} ms")
+
+        def log_message(self, format, *args):
+            pass
+
+    print(f"Collector stand-in listening on http://localhost:{port}/v1/traces")
+    HTTPServer(('0.0.0.0', port), CollectorHandler).serve_forever()
+
+
+if __name__ == "__main__":
+    run_collector(int(sys.argv[1]) if len(sys.argv) > 1 else 4318)